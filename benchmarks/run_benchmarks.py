@@ -0,0 +1,261 @@
+# This script runs the same benchmarks for the examples of all the chapters, so that the effect of a
+# change on the hot paths can be measured in the same way. Each workload runs in a new process:
+# it is called a few times to warm up (imports, caches, page faults) and then timed over a number of
+# repeats with time.perf_counter(). The report contains the median and the interquartile range (IQR)
+# of the times and the peak resident memory (RSS) of the process.
+#
+# $ python benchmarks/run_benchmarks.py --output results.json
+#
+# The results can be compared with a previous run, saved as a baseline. A workload is flagged as a
+# regression if its median is slower than the baseline median by more than the threshold and by
+# more than the IQR of the two runs.
+#
+# $ python benchmarks/run_benchmarks.py --baseline baseline.json --threshold 0.10
+#
+# A subset of workloads can be selected with --only, e.g. --only julia_numpy,diffusion_numpy.
+# The HTTP workloads need the server of chapter 8 running on port 8080 and are skipped otherwise.
+#
+import argparse
+import json
+import math
+import os
+import platform
+import queue
+import socket
+import sys
+import time
+import traceback
+import multiprocessing
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def add_path(chapter):
+    path = os.path.join(ROOT, chapter)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+#--------------------------------------------------------------------------------------------------
+#                                             Workloads
+#--------------------------------------------------------------------------------------------------
+# Each workload is a function that does the setup and returns the function to be timed.
+
+def julia_python():
+    add_path('ch2')
+    import hpc_ch2
+    hpc_ch2.c_real, hpc_ch2.c_imag = -0.62772, -.42193
+    zs, cs, width, height = hpc_ch2.z_points(-1.8, 1.8, -1.8, 1.8, 300)
+    return lambda: hpc_ch2.calculate_z_serial_purepython.__wrapped__(300, zs, cs)
+
+def julia_numpy():
+    add_path('ch2')
+    from julia_numpy import calculate_z_numpy, z_grid
+    zs, c, width, height = z_grid(-1.8, 1.8, -1.8, 1.8, 1000, -0.62772, -.42193)
+    return lambda: calculate_z_numpy(300, zs, c)
+
+def diffusion_numpy():
+    add_path('ch6')
+    from hpc_ch6_numpy import evolve
+    from hpc_ch6_inplace import init_grid
+    grid = init_grid((640, 640))
+    def run():
+        g = grid
+        for i in range(100):
+            g = evolve(g, 0.1)
+    return run
+
+def diffusion_inplace():
+    add_path('ch6')
+    from hpc_ch6_inplace import run_experiment
+    return lambda: run_experiment(100)
+
+def pi_python():
+    add_path('ch9')
+    from pi_parallel_worker import estimate_nbr_points_in_quarter_circle_python
+    return lambda: estimate_nbr_points_in_quarter_circle_python(1_000_000)
+
+def pi_numpy():
+    add_path('ch9')
+    from pi_parallel_worker import estimate_nbr_points_in_quarter_circle_numpy
+    return lambda: estimate_nbr_points_in_quarter_circle_numpy(10_000_000)
+
+def prime_search():
+    # check_prime() of the notebook ch9/prime_search.ipynb, range A
+    def check_prime(n):
+        if n % 2 == 0:
+            return False
+        for i in range(3, int(math.sqrt(n)) + 1, 2):
+            if n % i == 0:
+                return False
+        return True
+    return lambda: [n for n in range(100000000, 100010000) if check_prime(n)]
+
+def server_running(host='127.0.0.1', port=8080):
+    with socket.socket() as s:
+        s.settimeout(0.5)
+        return s.connect_ex((host, port)) == 0
+
+def http_serial():
+    add_path('ch8')
+    import crawler
+    return lambda: crawler.run_experiment('http://127.0.0.1:8080/add?name=bench_serial&delay=10&', 50)
+
+def http_threaded():
+    add_path('ch8')
+    import crawler
+    return lambda: crawler.run_experiment_threaded('http://127.0.0.1:8080/add?name=bench_threaded&delay=10&', 200, 20)
+
+def http_asyncio():
+    add_path('ch8')
+    import asyncio
+    import asyncio_crawler
+    return lambda: asyncio.run(asyncio_crawler.run_experiment(
+        'http://127.0.0.1:8080/add?name=bench_asyncio&delay=10&', 200))
+
+WORKLOADS = {
+    'julia_python': julia_python,
+    'julia_numpy': julia_numpy,
+    'diffusion_numpy': diffusion_numpy,
+    'diffusion_inplace': diffusion_inplace,
+    'pi_python': pi_python,
+    'pi_numpy': pi_numpy,
+    'prime_search': prime_search,
+    'http_serial': http_serial,
+    'http_threaded': http_threaded,
+    'http_asyncio': http_asyncio,
+}
+HTTP_WORKLOADS = ('http_serial', 'http_threaded', 'http_asyncio')
+
+#--------------------------------------------------------------------------------------------------
+#                                             Functions
+#--------------------------------------------------------------------------------------------------
+def peak_rss_bytes():
+    '''
+    Peak resident memory of the current process, None where the resource module is not available
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def time_workload(name, warmup, repeat, results):
+    '''
+    Run in a child process: setup the workload, warm it up and time it. Sends the times and the
+    peak memory, or the error of the workload.
+    '''
+    # the workloads print their progress, keep the report readable
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        fn = WORKLOADS[name]()
+        for i in range(warmup):
+            fn()
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+    except Exception:
+        results.put((None, None, traceback.format_exc()))
+    else:
+        results.put((times, peak_rss_bytes(), None))
+
+def summarize(times, peak_rss):
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {'median': float(median), 'iqr': float(q3 - q1), 'min': float(min(times)),
+            'times': [float(t) for t in times], 'peak_rss': peak_rss}
+
+class WorkloadError(Exception):
+    pass
+
+def run_benchmark(name, warmup=1, repeat=5):
+    '''
+    Time the workload in a new process. Raises WorkloadError if the workload fails or the process dies.
+    '''
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target=time_workload, args=(name, warmup, repeat, results))
+    p.start()
+    while True:
+        try:
+            times, peak_rss, error = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if p.exitcode is not None and results.empty():
+                raise WorkloadError('the process exited with code {}'.format(p.exitcode))
+    p.join()
+    if error is not None:
+        raise WorkloadError(error)
+    return summarize(times, peak_rss)
+
+def compare(results, baseline, threshold):
+    '''
+    Returns the names of the workloads that are slower than in the baseline
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        slowdown = result['median'] - base['median']
+        noise = max(result['iqr'], base['iqr'])
+        if slowdown > threshold * base['median'] and slowdown > noise:
+            regressions.append(name)
+    return regressions
+
+def print_report(results, baseline=None):
+    print('{:20s} {:>10s} {:>10s} {:>10s} {:>10s}'.format('workload', 'median s', 'IQR s', 'peak MB', 'vs base'))
+    for name, r in results.items():
+        rss = '{:.1f}'.format(r['peak_rss'] / 2**20) if r['peak_rss'] else '-'
+        ratio = '{:.2f}x'.format(r['median'] / baseline[name]['median']) if baseline and name in baseline else '-'
+        print('{:20s} {:10.4f} {:10.4f} {:>10s} {:>10s}'.format(name, r['median'], r['iqr'], rss, ratio))
+
+#--------------------------------------------------------------------------------------------------
+#                                             Application
+#--------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of the examples')
+    parser.add_argument('--only', type=str, default=None, help='Comma separated list of workloads')
+    parser.add_argument('--warmup', type=int, default=1, help='Number of warmup runs')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs')
+    parser.add_argument('--output', type=str, default=None, help='JSON file for the results')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON file of a previous run')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative slowdown flagged as regression')
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(WORKLOADS)
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error('unknown workload(s) {}, choose among {}'.format(', '.join(unknown), ', '.join(WORKLOADS)))
+    results = {}
+    failed = []
+    for name in names:
+        if name in HTTP_WORKLOADS and not server_running():
+            print(f'{name}: skipped, the server of chapter 8 is not running on port 8080')
+            continue
+        try:
+            results[name] = run_benchmark(name, args.warmup, args.repeat)
+        except WorkloadError as err:
+            print(f'{name}: FAILED\n{err}')
+            failed.append(name)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'cpu_count': os.cpu_count(), 'timestamp': time.time(),
+                       'warmup': args.warmup, 'repeat': args.repeat, 'results': results}, f, indent=2)
+
+    regressions = []
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for name in regressions:
+            print(f'REGRESSION: {name} is slower than the baseline')
+    sys.exit(1 if regressions or failed else 0)
@@ -0,0 +1,194 @@
+# This module provides timers, counters and spans to instrument the hot paths of a program. The
+# instrumentation is disabled by default and costs only a check of a global flag on each call, so
+# it can be left in the source code. It is enabled by setting the environment variable
+# HPC_INSTRUMENT=1 or by calling enable(). When enabled, the duration of each call is recorded in
+# a histogram with buckets of powers of two nanoseconds, together with the number of calls, the
+# total, minimum and maximum time. The results can be printed as text or saved as JSON.
+#
+#   from instrument import timer, span, count, report
+#
+#   @timer()
+#   def evolve(grid, dt):
+#       ...
+#
+#   with span("setup"):
+#       ...
+#   count("cache_miss")
+#   print(report())
+#
+# The profile decorator is compatible with line_profiler and memory_profiler: when the script is
+# run with kernprof or with python -m memory_profiler the profile injected by the tool in the
+# builtins is used, otherwise profile is the timer of this module.
+#
+import builtins
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+enabled = os.environ.get('HPC_INSTRUMENT', '') not in ('', '0')
+lock = threading.Lock()
+timings = {}
+counters = {}
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with lock:
+        timings.clear()
+        counters.clear()
+
+class Histogram:
+    '''
+    Number of calls, total, minimum and maximum time and the counts of the durations in buckets of
+    powers of two nanoseconds
+    '''
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.buckets = {}
+
+    def add(self, elapsed_ns):
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        if self.min_ns is None or elapsed_ns < self.min_ns:
+            self.min_ns = elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        bucket = elapsed_ns.bit_length()  # durations in [2**(bucket - 1), 2**bucket) ns
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def quantile(self, q):
+        '''
+        Upper bound of the bucket that contains the quantile q, in nanoseconds
+        '''
+        rank = q * self.calls
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return 2 ** bucket
+        return self.max_ns
+
+    def to_dict(self):
+        return {'calls': self.calls, 'total_ns': self.total_ns, 'min_ns': self.min_ns, 'max_ns': self.max_ns,
+                'p50_ns': self.quantile(0.5), 'p99_ns': self.quantile(0.99),
+                'buckets': {str(2 ** b): n for b, n in sorted(self.buckets.items())}}
+
+def record(name, elapsed_ns):
+    with lock:
+        histogram = timings.get(name)
+        if histogram is None:
+            histogram = timings[name] = Histogram()
+        histogram.add(elapsed_ns)
+
+def timer(name=None):
+    '''
+    Decorator that records the duration of each call of the function when the instrumentation
+    is enabled
+    '''
+    def decorator(fn):
+        label = name or fn.__qualname__
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(label, time.perf_counter_ns() - start)
+        return timed
+    return decorator
+
+class Span:
+    '''
+    Context manager that records the time spent in a block of code
+    '''
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter_ns() - self.start)
+        return False
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+null_span = NullSpan()
+
+def span(name):
+    if not enabled:
+        return null_span
+    return Span(name)
+
+def count(name, n=1):
+    if enabled:
+        with lock:
+            counters[name] = counters.get(name, 0) + n
+
+def to_dict():
+    with lock:
+        return {'timings': {name: h.to_dict() for name, h in timings.items()}, 'counters': dict(counters)}
+
+def save(filename):
+    with open(filename, 'w') as f:
+        json.dump(to_dict(), f, indent=2)
+
+def report():
+    '''
+    Text report of the timers, spans and counters
+    '''
+    lines = ['{:40s} {:>10s} {:>12s} {:>12s} {:>12s} {:>12s}'.format(
+        'name', 'calls', 'total ms', 'mean us', 'p50 us', 'p99 us')]
+    with lock:
+        for name, h in sorted(timings.items(), key=lambda item: item[1].total_ns, reverse=True):
+            lines.append('{:40s} {:10d} {:12.3f} {:12.3f} {:12.3f} {:12.3f}'.format(
+                name, h.calls, h.total_ns / 1e6, h.total_ns / h.calls / 1e3,
+                h.quantile(0.5) / 1e3, h.quantile(0.99) / 1e3))
+        for name, value in sorted(counters.items()):
+            lines.append('{:40s} {:10d}'.format(name, value))
+    return '\n'.join(lines)
+
+# use the profile decorator injected by kernprof (line_profiler) or memory_profiler, if any
+if hasattr(builtins, 'profile'):
+    profile = builtins.profile
+else:
+    profile = timer()
+
+if __name__ == "__main__":
+    @timer()
+    def square(x):
+        return x * x
+
+    start = time.perf_counter()
+    for i in range(1_000_000):
+        square(i)
+    disabled_time = time.perf_counter() - start
+    enable()
+    start = time.perf_counter()
+    for i in range(1_000_000):
+        square(i)
+    enabled_time = time.perf_counter() - start
+    with span('sleep'):
+        time.sleep(0.01)
+    count('calls', 1_000_000)
+    print(report())
+    print('1M calls: {:.3f} s disabled, {:.3f} s enabled'.format(disabled_time, enabled_time))
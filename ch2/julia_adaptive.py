@@ -0,0 +1,120 @@
+# This script computes the Julia set adaptively, iterating only a fraction of the points of the
+# grid. Most of the points either escape after a few iterations or are inside the set and reach
+# the maximum number of iterations, and they form large regions with the same count. The grid is
+# first split into coarse rectangles and the points on the border of each rectangle are computed.
+# If all the points on the border have the same count the rectangle is filled with that count
+# without computing its interior (Mariani-Silver algorithm), otherwise it is split into four
+# smaller rectangles and the same check is done on them. Rectangles smaller than min_size are
+# computed point by point, so only the regions close to the boundary of the set are refined.
+# The border check is exact for a connected Julia set, since a region with a different count
+# that does not touch the border would have to be enclosed in the rectangle; this is ruled out
+# by starting from rectangles much smaller than the set.
+#
+# $ python julia_adaptive.py
+#
+# The script compares the adaptive output with the full resolution one computed with the NumPy
+# engine in julia_numpy.py.
+#
+import time
+import numpy as np
+from julia_numpy import calculate_z_numpy, grid_axes
+#--------------------------------------------------------------------------------------------------
+#                                             Functions
+#--------------------------------------------------------------------------------------------------
+def compute_points(output, done, x, y, c, maxiter, requested):
+    '''
+    Compute the counts of the points marked in the boolean array requested that have not been
+    computed yet. Returns the number of points that have been iterated.
+    '''
+    # a point can be requested twice, e.g. on the border of two rectangles, the mask counts it once
+    rows, cols = np.nonzero(requested & ~done)
+    if rows.size == 0:
+        return 0
+    zs = np.empty(rows.size, dtype=np.complex128)
+    zs.real = x[cols]
+    zs.imag = y[rows]
+    output[rows, cols] = calculate_z_numpy(maxiter, zs, c)
+    done[rows, cols] = True
+    return rows.size
+
+def border_indexes(rect):
+    '''
+    Rows and columns of the points on the border of the rectangle (row0, row1, col0, col1)
+    '''
+    row0, row1, col0, col1 = rect
+    cols = np.arange(col0, col1)
+    rows = np.arange(row0 + 1, row1 - 1)
+    border_rows = np.concatenate([np.full(cols.size, row0), np.full(cols.size, row1 - 1), rows, rows])
+    border_cols = np.concatenate([cols, cols, np.full(rows.size, col0), np.full(rows.size, col1 - 1)])
+    return border_rows, border_cols
+
+def split_rect(rect):
+    '''
+    Split a rectangle into four rectangles
+    '''
+    row0, row1, col0, col1 = rect
+    row_mid = (row0 + row1) // 2
+    col_mid = (col0 + col1) // 2
+    return [(row0, row_mid, col0, col_mid), (row0, row_mid, col_mid, col1),
+            (row_mid, row1, col0, col_mid), (row_mid, row1, col_mid, col1)]
+
+def calculate_z_adaptive(x1, x2, y1, y2, desired_width, c, maxiter, coarse_size=64, min_size=8):
+    '''
+    Compute the Julia set on the grid defined by (x1, x2, y1, y2) using the Mariani-Silver
+    subdivision. Returns the 2D array of counts and the number of points that have been iterated.
+    '''
+    x, y = grid_axes(x1, x2, y1, y2, desired_width)
+    height, width = len(y), len(x)
+    output = np.zeros((height, width), dtype=np.int32)
+    done = np.zeros((height, width), dtype=bool)
+    nbr_iterated = 0
+    # coarse grid of rectangles
+    rects = [(row, min(row + coarse_size, height), col, min(col + coarse_size, width))
+             for row in range(0, height, coarse_size)
+             for col in range(0, width, coarse_size)]
+    while rects:
+        small = [r for r in rects if r[1] - r[0] <= min_size or r[3] - r[2] <= min_size]
+        large = [r for r in rects if r[1] - r[0] > min_size and r[3] - r[2] > min_size]
+        # compute all the points of the small rectangles and the borders of the large ones
+        # in one batch
+        requested = np.zeros((height, width), dtype=bool)
+        for row0, row1, col0, col1 in small:
+            requested[row0:row1, col0:col1] = True
+        borders = [border_indexes(r) for r in large]
+        for rows, cols in borders:
+            requested[rows, cols] = True
+        nbr_iterated += compute_points(output, done, x, y, c, maxiter, requested)
+        rects = []
+        for rect, (rows, cols) in zip(large, borders):
+            values = output[rows, cols]
+            if (values == values[0]).all():
+                row0, row1, col0, col1 = rect
+                output[row0 + 1:row1 - 1, col0 + 1:col1 - 1] = values[0]
+                done[row0 + 1:row1 - 1, col0 + 1:col1 - 1] = True
+            else:
+                rects.extend(split_rect(rect))
+    return output, nbr_iterated
+
+#--------------------------------------------------------------------------------------------------
+#                                             Application
+#--------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    x1, x2, y1, y2 = -1.8, 1.8, -1.8, 1.8
+    c_real, c_imag = -0.62772, -.42193
+    c = complex(c_real, c_imag)
+    for desired_width in (1000, 4000):
+        start = time.time()
+        output, nbr_iterated = calculate_z_adaptive(x1, x2, y1, y2, desired_width, c, 300)
+        adaptive_time = time.time() - start
+        print(f"Width {desired_width}: adaptive took {adaptive_time:.3f} seconds, "
+              f"iterated {nbr_iterated:,} of {output.size:,} points ({output.size / nbr_iterated:.1f}x fewer)")
+        if desired_width == 1000:
+            assert output.sum() == 33219980  # this sum is expected for 1000^2 grid with 300 iterations
+        # compare with the full resolution render
+        x, y = grid_axes(x1, x2, y1, y2, desired_width)
+        zs = x[np.newaxis, :] + 1j * y[:, np.newaxis]
+        start = time.time()
+        full = calculate_z_numpy(300, zs, c).reshape(output.shape)
+        print(f"Width {desired_width}: full render took {time.time() - start:.3f} seconds")
+        assert np.array_equal(output, full)
@@ -0,0 +1,109 @@
+# This module converts the iteration counts of the Julia set into images without going through
+# Python lists and array.array. The colour map of show_false_greyscale() in hpc_ch2.py is applied
+# to a NumPy array of counts in one pass and gives exactly the same RGB values. The images can be
+# shown with PIL or written to a PNG file one band of rows at a time, so that a very large render
+# (e.g. 16k x 16k) never needs a full size temporary copy of the image in memory. The PNG file is
+# written with zlib from the standard library. render_png() computes the bands of the Julia set
+# with the NumPy engine while it writes them, so the counts are never stored for the whole grid.
+#
+# $ python julia_image.py
+#
+import struct
+import time
+import zlib
+import numpy as np
+from PIL import Image
+from julia_numpy import calculate_z_numpy, grid_axes
+#--------------------------------------------------------------------------------------------------
+#                                             Functions
+#--------------------------------------------------------------------------------------------------
+def false_greyscale_rgb(counts, max_value):
+    '''
+    Colour map of show_false_greyscale(). Returns an array of uint8 with an extra last axis
+    for the red, green and blue values.
+    '''
+    # rescale to the inclusive range [0..255] as int(float(o) / max_value * 255)
+    limited = (counts / float(max_value) * 255).astype(np.uint32)
+    # the fancier colour map packs the value in the bytes of an unsigned int, with carries
+    packed = limited * (16 * (1 + 256 + 256 ** 2))
+    return packed.astype('<u4').view(np.uint8).reshape(counts.shape + (4,))[..., :3]
+
+def greyscale(counts, max_value):
+    '''
+    Colour map of show_greyscale(), values in [0..255]
+    '''
+    return (counts / float(max_value) * 255).astype(np.uint8)
+
+def show_false_greyscale_array(output, width, height):
+    '''
+    Show the counts in a false greyscale using PIL. Rows are flipped as with the "RGBX", 0, -1
+    raw mode of show_false_greyscale().
+    '''
+    counts = np.asarray(output).reshape(height, width)
+    rgb = false_greyscale_rgb(counts[::-1], counts.max())
+    Image.fromarray(np.ascontiguousarray(rgb), "RGB").show()
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+def write_png(filename, bands, width, height, channels=3):
+    '''
+    Write a PNG file from an iterable of uint8 arrays of shape (rows, width, channels), or
+    (rows, width) for greyscale, that cover the image from top to bottom. Each band is filtered,
+    compressed and written before the next one is requested.
+    '''
+    colour_type = {1: 0, 3: 2}[channels]
+    compressor = zlib.compressobj(6)
+    nbr_rows = 0
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack(">IIBBBBB", width, height, 8, colour_type, 0, 0, 0)))
+        for band in bands:
+            band = band.reshape(band.shape[0], width * channels)
+            # each row starts with the filter type byte, 0 = none
+            rows = np.zeros((band.shape[0], width * channels + 1), dtype=np.uint8)
+            rows[:, 1:] = band
+            data = compressor.compress(rows.tobytes())
+            if data:
+                f.write(png_chunk(b'IDAT', data))
+            nbr_rows += band.shape[0]
+        f.write(png_chunk(b'IDAT', compressor.flush()))
+        f.write(png_chunk(b'IEND', b''))
+    assert nbr_rows == height
+
+def save_false_greyscale_png(filename, counts, band_rows=256):
+    '''
+    Save a 2D array of counts in a false greyscale PNG file, band by band, with the same
+    orientation as show_false_greyscale()
+    '''
+    height, width = counts.shape
+    max_value = counts.max()
+    flipped = counts[::-1]  # a view, no copy
+    bands = (false_greyscale_rgb(flipped[row:row + band_rows], max_value)
+             for row in range(0, height, band_rows))
+    write_png(filename, bands, width, height)
+
+def render_png(filename, x1, x2, y1, y2, desired_width, c, maxiter, band_rows=256):
+    '''
+    Compute the Julia set band by band and write it to a false greyscale PNG file. The counts are
+    scaled by maxiter, that is the maximum count when the render contains points of the set.
+    '''
+    x, y = grid_axes(x1, x2, y1, y2, desired_width)
+    y = y[::-1]  # same orientation as show_false_greyscale()
+    def bands():
+        for row in range(0, len(y), band_rows):
+            zs = x[np.newaxis, :] + 1j * y[row:row + band_rows, np.newaxis]
+            counts = calculate_z_numpy(maxiter, zs, c).reshape(zs.shape)
+            yield false_greyscale_rgb(counts, maxiter)
+    write_png(filename, bands(), len(x), len(y))
+
+#--------------------------------------------------------------------------------------------------
+#                                             Application
+#--------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    x1, x2, y1, y2 = -1.8, 1.8, -1.8, 1.8
+    c = complex(-0.62772, -.42193)
+    start = time.time()
+    render_png("julia.png", x1, x2, y1, y2, 4000, c, 300)
+    print(f"render_png took {time.time() - start:.3f} seconds")
@@ -0,0 +1,110 @@
+# This module contains a NumPy version of the function that computes the Julia set. It has the
+# same signature as calculate_z_serial_purepython() in hpc_ch2.py so it can be used as a drop-in
+# replacement. The points are stored in complex128 arrays and the update rule z = z * z + c is
+# applied to all the points at once. After each iteration the points that have escaped (|z| >= 2)
+# are removed from the arrays of active points, so they stop costing anything.
+#
+# The grid of points is built by z_grid() as a 2D complex128 array, without creating a million
+# Python complex objects, and the constant c is passed as a single complex number that is broadcast.
+# The coordinates are accumulated in the same order as in z_points() in hpc_ch2.py so the result,
+# and its checksum, are the same. z_rows() returns the same grid one row at a time for streaming.
+#
+# $ python julia_numpy.py
+#
+import time
+import numpy as np
+#--------------------------------------------------------------------------------------------------
+#                                             Functions
+#--------------------------------------------------------------------------------------------------
+def accumulate_coords(start, stop, step):
+    '''
+    Returns the coordinates start, start + step, start + step + step, ... that are before stop. The
+    values are summed one after the other, like in the while loops of z_points(), so that they are
+    bitwise identical to the ones computed by the loops.
+    '''
+    nbr_steps = int(abs((stop - start) / step)) + 2  # a few more than needed, cut below
+    steps = np.full(nbr_steps, step, dtype=np.float64)
+    steps[0] = start
+    coords = np.add.accumulate(steps)  # sequential sum, not pairwise
+    if step > 0:
+        return coords[coords < stop]
+    return coords[coords > stop]
+
+def grid_axes(x1, x2, y1, y2, desired_width):
+    '''
+    Returns the x and y coordinates of the grid defined by (x1, x2, y1, y2). The y axis goes from
+    y2 down to y1 as in z_points().
+    '''
+    x_step = (x2 - x1) / desired_width
+    y_step = (y1 - y2) / desired_width
+    x = accumulate_coords(x1, x2, x_step)
+    y = accumulate_coords(y2, y1, y_step)
+    return x, y
+
+def z_grid(x1, x2, y1, y2, desired_width, c_real, c_imag):
+    '''
+    Array version of z_points(). Returns the 2D complex128 array of points with shape (height, width),
+    the constant c as a complex scalar, the width and the height of the grid.
+    '''
+    x, y = grid_axes(x1, x2, y1, y2, desired_width)
+    zs = np.empty((len(y), len(x)), dtype=np.complex128)
+    zs.real = x[np.newaxis, :]
+    zs.imag = y[:, np.newaxis]
+    return zs, complex(c_real, c_imag), len(x), len(y)
+
+def z_rows(x1, x2, y1, y2, desired_width):
+    '''
+    Lazy version of z_grid(). Yields the index and the complex128 array of each row of the grid, so
+    that only one row is in memory at a time.
+    '''
+    x, y = grid_axes(x1, x2, y1, y2, desired_width)
+    for i, ycoord in enumerate(y):
+        row = np.empty(len(x), dtype=np.complex128)
+        row.real = x
+        row.imag = ycoord
+        yield i, row
+
+def calculate_z_numpy(maxiter, zs, cs):
+    '''
+    Calculate output array using Julia update rule. zs is a sequence or array of complex points,
+    cs can be a sequence of the same length or a single complex constant that is broadcast.
+    '''
+    z = np.array(zs, dtype=np.complex128).ravel()  # copy, the update is done in place
+    c = np.asarray(cs, dtype=np.complex128)
+    if c.ndim > 0:
+        c = np.broadcast_to(c, np.shape(zs)).ravel()
+    output = np.full(z.size, maxiter, dtype=np.int32)
+    # indexes of the points that have not escaped yet
+    active = np.arange(z.size)
+    for n in range(maxiter):
+        escaped = np.abs(z) >= 2
+        if escaped.any():
+            output[active[escaped]] = n
+            # shrink the arrays to the points that are still active
+            keep = ~escaped
+            active = active[keep]
+            z = z[keep]
+            if c.ndim > 0:
+                c = c[keep]
+            if active.size == 0:
+                break
+        np.multiply(z, z, out=z)
+        np.add(z, c, out=z)
+    return output
+
+#--------------------------------------------------------------------------------------------------
+#                                             Application
+#--------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    x1, x2, y1, y2 = -1.8, 1.8, -1.8, 1.8
+    desired_width = 1000
+    c_real, c_imag = -0.62772, -.42193
+    start = time.time()
+    zs, c, width, height = z_grid(x1, x2, y1, y2, desired_width, c_real, c_imag)
+    print(f"z_grid took {time.time() - start:.3f} seconds")
+    print("Total elements:", zs.size)
+    start = time.time()
+    output = calculate_z_numpy(300, zs, c)
+    print(f"calculate_z_numpy took {time.time() - start:.3f} seconds")
+    assert output.sum() == 33219980  # this sum is expected for 1000^2 grid with 300 iterations
@@ -0,0 +1,124 @@
+# This script computes the Julia set on all the cores using a pool of processes. The grid of points
+# in the complex plane is split into tiles (blocks of rows and columns) and each tile is a task for
+# the pool. The output array of iteration counts is backed by a block of shared memory, as in the
+# script ch9/shared_memory.py, so each worker writes the counts of its tile directly in the output
+# and only a small record with the timing of the tile is sent back to the main process.
+# The tiles are sent to the workers one at a time with imap_unordered(), so a worker that has
+# finished a cheap tile, far from the set, takes the next one while another worker is still
+# computing an expensive tile close to the boundary of the set.
+#
+# $ python julia_tiles.py
+#
+# The number of workers and the size of the tiles can be set from the command line
+#
+# $ python julia_tiles.py --nbr_workers 4 --tile_height 50 --tile_width 1000
+#
+import argparse
+import os
+import time
+import numpy as np
+from multiprocessing import Pool, cpu_count, shared_memory
+from julia_numpy import calculate_z_numpy, grid_axes
+#--------------------------------------------------------------------------------------------------
+#                                             Functions
+#--------------------------------------------------------------------------------------------------
+# state of each worker process, set by init_worker()
+worker_state = {}
+
+def make_tiles(height, width, tile_height, tile_width):
+    '''
+    Split a grid of height x width points into tiles. Each tile is a tuple (row0, row1, col0, col1).
+    Setting tile_width to the width of the grid gives tiles made of whole rows.
+    '''
+    return [(row, min(row + tile_height, height), col, min(col + tile_width, width))
+            for row in range(0, height, tile_height)
+            for col in range(0, width, tile_width)]
+
+def init_worker(shm_name, shape, x, y, c, maxiter):
+    '''
+    Attach the worker process to the shared output array and store the grid axes
+    '''
+    shm = shared_memory.SharedMemory(name=shm_name)
+    worker_state['shm'] = shm  # keep a reference, the array is a view on its buffer
+    worker_state['output'] = np.ndarray(shape, dtype=np.int32, buffer=shm.buf)
+    worker_state['x'] = x
+    worker_state['y'] = y
+    worker_state['c'] = c
+    worker_state['maxiter'] = maxiter
+
+def render_tile(tile):
+    '''
+    Compute the iteration counts of one tile and write them in the shared output array.
+    Returns the tile, the pid of the worker and the time taken.
+    '''
+    row0, row1, col0, col1 = tile
+    start = time.perf_counter()
+    x = worker_state['x'][col0:col1]
+    y = worker_state['y'][row0:row1]
+    zs = np.empty((row1 - row0, col1 - col0), dtype=np.complex128)
+    zs.real = x[np.newaxis, :]
+    zs.imag = y[:, np.newaxis]
+    counts = calculate_z_numpy(worker_state['maxiter'], zs, worker_state['c'])
+    worker_state['output'][row0:row1, col0:col1] = counts.reshape(zs.shape)
+    return tile, os.getpid(), time.perf_counter() - start
+
+def render_tiled(x1, x2, y1, y2, desired_width, c, maxiter, nbr_workers=None, tile_height=25, tile_width=None):
+    '''
+    Compute the Julia set on a pool of nbr_workers processes. Returns the 2D array of iteration
+    counts and the list of (tile, pid, seconds) records, in order of completion.
+    '''
+    x, y = grid_axes(x1, x2, y1, y2, desired_width)
+    shape = (len(y), len(x))
+    tiles = make_tiles(shape[0], shape[1], tile_height, tile_width or shape[1])
+    nbytes = shape[0] * shape[1] * np.dtype(np.int32).itemsize
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    try:
+        output = np.ndarray(shape, dtype=np.int32, buffer=shm.buf)
+        with Pool(nbr_workers or cpu_count(), initializer=init_worker,
+                  initargs=(shm.name, shape, x, y, c, maxiter)) as pool:
+            timings = list(pool.imap_unordered(render_tile, tiles, chunksize=1))
+        result = output.copy()  # the shared block is released below
+        del output
+    finally:
+        shm.close()
+        shm.unlink()
+    return result, timings
+
+def print_timings(timings, wall_time, nbr_slowest=5):
+    '''
+    Print the time spent in each worker and the slowest tiles
+    '''
+    per_worker = {}
+    for tile, pid, secs in timings:
+        count, total = per_worker.get(pid, (0, 0.0))
+        per_worker[pid] = (count + 1, total + secs)
+    print(f"{len(timings)} tiles in {wall_time:.3f} s")
+    for pid, (count, total) in sorted(per_worker.items()):
+        print(f"  worker {pid}: {count} tiles, {total:.3f} s busy, {total / wall_time:.0%} of wall time")
+    tile_secs = np.array([secs for _, _, secs in timings])
+    print("  tile time min {:.4f} s, median {:.4f} s, max {:.4f} s".format(
+        tile_secs.min(), np.median(tile_secs), tile_secs.max()))
+    print(f"  slowest {nbr_slowest} tiles (row0, row1, col0, col1):")
+    for tile, pid, secs in sorted(timings, key=lambda t: t[2], reverse=True)[:nbr_slowest]:
+        print(f"    {tile} {secs:.4f} s on worker {pid}")
+
+#--------------------------------------------------------------------------------------------------
+#                                             Application
+#--------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tiled multiprocessing Julia set')
+    parser.add_argument('--nbr_workers', type=int, default=cpu_count(), help='Number of processes')
+    parser.add_argument('--tile_height', type=int, default=25, help='Number of rows in a tile')
+    parser.add_argument('--tile_width', type=int, default=None, help='Number of columns in a tile, default whole rows')
+    args = parser.parse_args()
+
+    x1, x2, y1, y2 = -1.8, 1.8, -1.8, 1.8
+    desired_width = 1000
+    c_real, c_imag = -0.62772, -.42193
+    start = time.perf_counter()
+    output, timings = render_tiled(x1, x2, y1, y2, desired_width, complex(c_real, c_imag), 300,
+                                   args.nbr_workers, args.tile_height, args.tile_width)
+    wall_time = time.perf_counter() - start
+    print_timings(timings, wall_time)
+    assert output.sum() == 33219980  # this sum is expected for 1000^2 grid with 300 iterations
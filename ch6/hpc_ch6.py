@@ -17,10 +17,21 @@
 # kernprof command
 # 
 # $ kernprof -l -v hpc_ch6.py
+#
+# The @profile decorator is imported from ch2/instrument.py: it is the decorator of kernprof when
+# the script is run with kernprof, otherwise a timer that is enabled with HPC_INSTRUMENT=1
+#
+# $ HPC_INSTRUMENT=1 python hpc_ch6.py
 
+import os
+import sys
 import time
 import cProfile
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ch2'))
+import instrument
+from instrument import profile
+
 grid_shape = (640, 640)
 
 @profile
@@ -55,4 +66,6 @@ def run_experiment(num_iterations):
 
 if __name__ == "__main__":
     t = run_experiment(500)
-    print('execution time: ', t)
\ No newline at end of file
+    print('execution time: ', t)
+    if instrument.enabled:
+        print(instrument.report())
\ No newline at end of file
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# This script solves the diffusion equation as hpc_ch6_numpy.py but without allocating new arrays
+# at each step. The laplacian in hpc_ch6_numpy.py is computed with four np.roll() calls and 4 * grid,
+# each one creating a temporary array of the size of the grid, and evolve() returns a new grid at
+# each iteration. Here two grids are allocated once, grid and next_grid, and they are swapped after
+# each step (double buffering). The periodic stencil is computed with slices, the shifted copies
+# of the grid are added in place with the out= argument of the NumPy functions, so no temporary
+# arrays are created. The operations are done in the same order as in hpc_ch6_numpy.py so the
+# result is bitwise identical.
+#
+# $ python hpc_ch6_inplace.py
+#
+# The script prints the peak of the temporary memory allocated by one step of each version,
+# measured with tracemalloc.
+#
+import time
+import tracemalloc
+import numpy as np
+from numpy import zeros
+from hpc_ch6_numpy import evolve
+
+def laplacian_inplace(grid, out, scratch):
+    '''
+    Periodic laplacian of grid written in out. scratch is an array of the same shape used for 4 * grid.
+    The terms are summed in the same order as roll(grid, +1, 0) + roll(grid, -1, 0) + roll(grid, +1, 1)
+    + roll(grid, -1, 1) - 4 * grid.
+    '''
+    # roll(grid, +1, 0)
+    out[1:] = grid[:-1]
+    out[0] = grid[-1]
+    # + roll(grid, -1, 0)
+    np.add(out[:-1], grid[1:], out=out[:-1])
+    np.add(out[-1], grid[0], out=out[-1])
+    # + roll(grid, +1, 1)
+    np.add(out[:, 1:], grid[:, :-1], out=out[:, 1:])
+    np.add(out[:, 0], grid[:, -1], out=out[:, 0])
+    # + roll(grid, -1, 1)
+    np.add(out[:, :-1], grid[:, 1:], out=out[:, :-1])
+    np.add(out[:, -1], grid[:, 0], out=out[:, -1])
+    # - 4 * grid
+    np.multiply(grid, 4, out=scratch)
+    np.subtract(out, scratch, out=out)
+    return out
+
+def evolve_inplace(grid, next_grid, scratch, dt, D=1):
+    '''
+    Write grid + dt * D * laplacian(grid) in next_grid
+    '''
+    laplacian_inplace(grid, next_grid, scratch)
+    np.multiply(next_grid, dt * D, out=next_grid)
+    np.add(next_grid, grid, out=next_grid)
+    return next_grid
+
+def init_grid(grid_shape):
+    grid = zeros(grid_shape)
+    block_low = int(grid_shape[0] * 0.4)
+    block_high = int(grid_shape[0] * 0.5)
+    grid[block_low:block_high, block_low:block_high] = 0.005
+    return grid
+
+def run_experiment(num_iterations, grid_shape=(640, 640)):
+    grid = init_grid(grid_shape)
+    next_grid = zeros(grid_shape)
+    scratch = zeros(grid_shape)
+
+    start = time.time()
+    for i in range(num_iterations):
+        evolve_inplace(grid, next_grid, scratch, 0.1)
+        grid, next_grid = next_grid, grid
+    return grid, time.time() - start
+
+def step_allocation(step):
+    '''
+    Peak memory in bytes allocated while running step()
+    '''
+    tracemalloc.start()
+    step()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+if __name__ == "__main__":
+    num_iterations = 500
+    grid_shape = (640, 640)
+    grid, exec_time = run_experiment(num_iterations, grid_shape)
+    print('in place execution time: {:.2f} sec.'.format(exec_time))
+
+    # check that the result is the same as the one computed with np.roll
+    roll_grid = init_grid(grid_shape)
+    start = time.time()
+    for i in range(num_iterations):
+        roll_grid = evolve(roll_grid, 0.1)
+    print('roll execution time: {:.2f} sec.'.format(time.time() - start))
+    assert np.array_equal(grid, roll_grid)
+
+    grid = init_grid(grid_shape)
+    next_grid = zeros(grid_shape)
+    scratch = zeros(grid_shape)
+    roll_bytes = step_allocation(lambda: evolve(grid, 0.1))
+    inplace_bytes = step_allocation(lambda: evolve_inplace(grid, next_grid, scratch, 0.1))
+    print('peak temporary memory per step: roll {:,} bytes ({:.1f} grids), in place {:,} bytes'.format(
+        roll_bytes, roll_bytes / grid.nbytes, inplace_bytes))
+    print('saved per step: {:,} bytes'.format(roll_bytes - inplace_bytes))
@@ -12,6 +12,19 @@
 #
 # $ python -m cProfile -o profile.stats hpc_ch6_numpy.py
 #
+# The grid can be saved every N steps in a stack of snapshots, a memory-mapped .npy file with shape
+# (number of snapshots, rows, columns), that can be post-processed without running the experiment
+# again. The snapshots are written by a separate thread so the compute loop only makes a copy of
+# the grid. A run that has been interrupted can be restarted from its last snapshot
+#
+# $ python hpc_ch6_numpy.py --num_iterations 100000 --snapshot_every 1000 --snapshot_file diffusion.npy
+# $ python hpc_ch6_numpy.py --num_iterations 100000 --snapshot_every 1000 --snapshot_file diffusion.npy --restart
+#
+import argparse
+import json
+import os
+import queue
+import threading
 import numpy as np
 from numpy import zeros, roll
 import time
@@ -28,19 +41,136 @@ def laplacian(grid):
 def evolve(grid, dt, D=1):
     return grid + dt * D * laplacian(grid)
 
-def run_experiment(num_iterations):
+class SnapshotWriter:
+    '''
+    Write snapshots of the grid in a memory-mapped .npy stack from a background thread. The number
+    of the last step that has been saved is kept in a small JSON file next to the stack.
+    '''
+    def __init__(self, filename, grid_shape, nbr_snapshots, snapshot_every, restart=False):
+        self.filename = filename
+        self.meta_filename = filename + '.json'
+        self.snapshot_every = snapshot_every
+        if restart:
+            self.stack = self.open_stack(grid_shape, nbr_snapshots)
+        else:
+            self.stack = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64,
+                                                   shape=(nbr_snapshots,) + grid_shape)
+            self.write_meta(-1, 0)
+        self.error = None
+        # at most two snapshots waiting, the compute loop waits only if the disk is slower than that
+        self.queue = queue.Queue(maxsize=2)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def open_stack(self, grid_shape, nbr_snapshots):
+        '''
+        Open the stack of a previous run, grown to nbr_snapshots if the new run is longer
+        '''
+        with open(self.meta_filename) as f:
+            meta = json.load(f)
+        if meta['snapshot_every'] != self.snapshot_every:
+            raise ValueError('{} has a snapshot every {} steps, cannot restart with a snapshot every {}'.format(
+                self.filename, meta['snapshot_every'], self.snapshot_every))
+        stack = np.load(self.filename, mmap_mode='r+')
+        if stack.shape[1:] != grid_shape:
+            raise ValueError('{} has snapshots of shape {}, the grid has shape {}'.format(
+                self.filename, stack.shape[1:], grid_shape))
+        if stack.shape[0] < nbr_snapshots:
+            tmp_filename = self.filename + '.tmp.npy'
+            grown = np.lib.format.open_memmap(tmp_filename, mode='w+', dtype=np.float64,
+                                              shape=(nbr_snapshots,) + grid_shape)
+            grown[:stack.shape[0]] = stack
+            grown.flush()
+            del stack, grown
+            os.replace(tmp_filename, self.filename)
+            stack = np.load(self.filename, mmap_mode='r+')
+        return stack
+
+    def write_meta(self, index, step):
+        # write and rename, so that the file is never half written
+        tmp_filename = self.meta_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump({'index': index, 'step': step, 'snapshot_every': self.snapshot_every}, f)
+        os.replace(tmp_filename, self.meta_filename)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue  # keep draining the queue, save() must not block
+            index, step, grid = item
+            try:
+                self.stack[index] = grid
+                self.stack.flush()
+                self.write_meta(index, step)
+            except Exception as err:
+                self.error = err
+
+    def save(self, step, grid):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((step // self.snapshot_every - 1, step, grid.copy()))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.stack.flush()
+        if self.error is not None:
+            raise self.error
+
+def last_snapshot(filename):
+    '''
+    Returns the step and the grid of the last snapshot saved in filename, (0, None) if there is none
+    '''
+    if not os.path.exists(filename) or not os.path.exists(filename + '.json'):
+        return 0, None
+    with open(filename + '.json') as f:
+        meta = json.load(f)
+    if meta['index'] < 0:
+        return 0, None
+    stack = np.load(filename, mmap_mode='r')
+    return meta['step'], np.array(stack[meta['index']])
+
+def run_experiment(num_iterations, snapshot_every=None, snapshot_file=None, restart=False):
     grid_shape = (640, 640)
     grid = zeros(grid_shape)
     
     block_low = int(grid_shape[0] * 0.4)
     block_high = int(grid_shape[0] * 0.5)
     grid[block_low:block_high, block_low:block_high] = 0.005
+
+    first_step = 0
+    writer = None
+    if snapshot_every:
+        # with no snapshot yet the run starts from the beginning
+        restart = restart and os.path.exists(snapshot_file) and os.path.exists(snapshot_file + '.json')
+        if restart:
+            first_step, last_grid = last_snapshot(snapshot_file)
+            if last_grid is not None:
+                grid = last_grid
+                print('restarting from step {}'.format(first_step))
+        writer = SnapshotWriter(snapshot_file, grid_shape, num_iterations // snapshot_every,
+                                snapshot_every, restart)
     
     start = time.time()
-    for i in range(num_iterations):
-        grid = evolve(grid, 0.1)
+    try:
+        for i in range(first_step, num_iterations):
+            grid = evolve(grid, 0.1)
+            if writer is not None and (i + 1) % snapshot_every == 0:
+                writer.save(i + 1, grid)
+    finally:
+        if writer is not None:
+            writer.close()
     return time.time() - start
 
 if __name__ == "__main__":
-    exec_time = run_experiment(500)
+    parser = argparse.ArgumentParser(description='Diffusion equation with NumPy')
+    parser.add_argument('--num_iterations', type=int, default=500, help='Number of steps')
+    parser.add_argument('--snapshot_every', type=int, default=None, help='Save the grid every N steps')
+    parser.add_argument('--snapshot_file', type=str, default='diffusion.npy', help='Memory-mapped stack of snapshots')
+    parser.add_argument('--restart', action="store_true", default=False, help='Restart from the last snapshot')
+    args = parser.parse_args()
+    exec_time = run_experiment(args.num_iterations, args.snapshot_every, args.snapshot_file, args.restart)
     print('execution time: {:.2f} sec.'.format(exec_time))
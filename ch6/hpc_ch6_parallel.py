@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# This script solves the diffusion equation of hpc_ch6_numpy.py on more than one process. The grid,
+# periodic in both directions, is split into horizontal strips of rows, one for each worker process.
+# Each strip has two more rows, the halos, that contain a copy of the last row of the strip above
+# and of the first row of the strip below. After each step every worker sends its first and last
+# rows to the neighbours, that store them in their halos, so that the next step can be computed
+# without reading the other strips. Two transports are available for the halo exchange:
+#
+# shm:   each strip lives in a block of multiprocessing.shared_memory. A worker writes its boundary
+#        rows directly in the halos of the neighbours' blocks and all the workers wait on a barrier
+#        before the next step.
+# queue: a local stand-in for mpi4py. Each worker keeps its strip in private memory and exchanges
+#        the rows with messages, using a small communicator with the same sendrecv() method of
+#        mpi4py.MPI.Comm. When the script is started with mpiexec and mpi4py is available, the
+#        same worker function runs on MPI.COMM_WORLD
+#
+#        $ mpiexec -n 4 python hpc_ch6_parallel.py --mpi
+#
+# The result is the same, bitwise, as the one computed on a single process by hpc_ch6_numpy.py.
+# The script prints the time of a strong scaling run (fixed grid, more workers) and of a weak
+# scaling run (fixed number of rows per worker).
+#
+# $ python hpc_ch6_parallel.py --transport shm --max_workers 4
+#
+import argparse
+import copy
+import time
+import numpy as np
+from numpy import roll
+from multiprocessing import Barrier, Process, Queue, cpu_count, shared_memory
+from hpc_ch6_numpy import evolve
+from hpc_ch6_inplace import init_grid
+
+def split_rows(nbr_rows, nbr_workers):
+    '''
+    Returns the (first, last + 1) rows of each strip
+    '''
+    bounds = np.linspace(0, nbr_rows, nbr_workers + 1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def evolve_strip(ext, dt, D=1):
+    '''
+    Evolve the rows of a strip with one halo row above and one below. The terms are summed in the
+    same order as laplacian() in hpc_ch6_numpy.py.
+    '''
+    center = ext[1:-1]
+    lap = ext[:-2] + ext[2:] + roll(center, +1, 1) + roll(center, -1, 1) - 4 * center
+    return center + dt * D * lap
+
+def strip_with_halos(grid, row0, row1):
+    nbr_rows = grid.shape[0]
+    return np.concatenate([grid[(row0 - 1) % nbr_rows][np.newaxis], grid[row0:row1],
+                           grid[row1 % nbr_rows][np.newaxis]])
+
+#--------------------------------------------------------------------------------------------------
+#                                     Shared memory transport
+#--------------------------------------------------------------------------------------------------
+def shm_worker(rank, shm_names, shapes, num_iterations, dt, barrier):
+    size = len(shm_names)
+    blocks = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    # two buffers for each strip, the current one and the next one
+    strips = [np.ndarray((2,) + shape, dtype=np.float64, buffer=block.buf) for block, shape in zip(blocks, shapes)]
+    mine, up, down = strips[rank], strips[(rank - 1) % size], strips[(rank + 1) % size]
+    cur = 0
+    try:
+        for i in range(num_iterations):
+            nxt = 1 - cur
+            mine[nxt, 1:-1] = evolve_strip(mine[cur], dt)
+            # halo exchange, the first row goes below the strip above and the last row above the strip below
+            up[nxt, -1] = mine[nxt, 1]
+            down[nxt, 0] = mine[nxt, -2]
+            barrier.wait()
+            cur = nxt
+    except BaseException:
+        # break the barrier, the other workers get a BrokenBarrierError instead of waiting forever
+        barrier.abort()
+        raise
+    del strips, mine, up, down
+    for block in blocks:
+        block.close()
+
+def run_shm(grid, nbr_workers, num_iterations, dt=0.1):
+    '''
+    Solve on nbr_workers processes with the strips in shared memory. Returns the grid and the time.
+    '''
+    bounds = split_rows(grid.shape[0], nbr_workers)
+    shapes = [(row1 - row0 + 2, grid.shape[1]) for row0, row1 in bounds]
+    blocks = [shared_memory.SharedMemory(create=True, size=2 * rows * cols * 8) for rows, cols in shapes]
+    try:
+        strips = [np.ndarray((2,) + shape, dtype=np.float64, buffer=block.buf) for block, shape in zip(blocks, shapes)]
+        for strip, (row0, row1) in zip(strips, bounds):
+            strip[0] = strip_with_halos(grid, row0, row1)
+        barrier = Barrier(nbr_workers)
+        processes = [Process(target=shm_worker, args=(rank, [b.name for b in blocks], shapes, num_iterations, dt, barrier))
+                     for rank in range(nbr_workers)]
+        start = time.time()
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        exec_time = time.time() - start
+        failed = [rank for rank, p in enumerate(processes) if p.exitcode != 0]
+        if failed:
+            raise RuntimeError('shm workers {} failed'.format(failed))
+        cur = num_iterations % 2
+        result = np.concatenate([strip[cur, 1:-1] for strip in strips])
+        del strips, strip
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return result, exec_time
+
+#--------------------------------------------------------------------------------------------------
+#                                     Message passing transport
+#--------------------------------------------------------------------------------------------------
+class QueueComm:
+    '''
+    Minimal stand-in for an mpi4py communicator, with one inbox queue for each rank
+    '''
+    def __init__(self, rank, inboxes):
+        self.rank = rank
+        self.inboxes = inboxes
+        self.pending = {}
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return len(self.inboxes)
+
+    def send(self, obj, dest, tag=0):
+        # Queue.put() pickles obj later in a feeder thread, send a copy so that the caller can
+        # reuse its buffer as soon as send() returns, as with MPI
+        self.inboxes[dest].put((self.rank, tag, copy.deepcopy(obj)))
+
+    def recv(self, source, tag=0):
+        # messages of other sources or tags that arrive first are kept for later
+        while (source, tag) not in self.pending:
+            msg_source, msg_tag, obj = self.inboxes[self.rank].get()
+            self.pending[(msg_source, msg_tag)] = obj
+        return self.pending.pop((source, tag))
+
+    def sendrecv(self, sendobj, dest, sendtag=0, source=0, recvtag=0):
+        self.send(sendobj, dest, sendtag)
+        return self.recv(source, recvtag)
+
+def comm_worker(comm, strip, num_iterations, dt, results=None):
+    '''
+    Evolve a strip with halos, exchanging the boundary rows through comm. The tags carry the step
+    number so that a message of the next step is not mistaken for one of the current step.
+    '''
+    rank, size = comm.Get_rank(), comm.Get_size()
+    up, down = (rank - 1) % size, (rank + 1) % size
+    ext = strip.copy()
+    for i in range(num_iterations):
+        ext[1:-1] = evolve_strip(ext, dt)
+        ext[0] = comm.sendrecv(ext[-2], dest=down, sendtag=2 * i, source=up, recvtag=2 * i)
+        ext[-1] = comm.sendrecv(ext[1], dest=up, sendtag=2 * i + 1, source=down, recvtag=2 * i + 1)
+    if results is not None:
+        results.put((rank, ext[1:-1]))
+    return ext[1:-1]
+
+def run_queue(grid, nbr_workers, num_iterations, dt=0.1):
+    '''
+    Solve on nbr_workers processes exchanging the halos with messages. Returns the grid and the time.
+    '''
+    bounds = split_rows(grid.shape[0], nbr_workers)
+    inboxes = [Queue() for rank in range(nbr_workers)]
+    results = Queue()
+    processes = [Process(target=comm_worker, args=(QueueComm(rank, inboxes), strip_with_halos(grid, row0, row1),
+                                                   num_iterations, dt, results))
+                 for rank, (row0, row1) in enumerate(bounds)]
+    start = time.time()
+    for p in processes:
+        p.start()
+    strips = dict(results.get() for p in processes)
+    for p in processes:
+        p.join()
+    exec_time = time.time() - start
+    return np.concatenate([strips[rank] for rank in range(nbr_workers)]), exec_time
+
+def run_mpi(grid_shape, num_iterations, dt=0.1):
+    '''
+    Run comm_worker() on MPI.COMM_WORLD, the grid is gathered on rank 0
+    '''
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    grid = init_grid(grid_shape)
+    row0, row1 = split_rows(grid_shape[0], comm.Get_size())[comm.Get_rank()]
+    start = time.time()
+    strip = comm_worker(comm, strip_with_halos(grid, row0, row1), num_iterations, dt)
+    strips = comm.gather(strip, root=0)
+    if comm.Get_rank() == 0:
+        result = np.concatenate(strips)
+        print('MPI {} ranks execution time: {:.2f} sec.'.format(comm.Get_size(), time.time() - start))
+        print('same as single process:', np.array_equal(result, run_serial(init_grid(grid_shape), num_iterations)))
+
+def run_serial(grid, num_iterations, dt=0.1):
+    for i in range(num_iterations):
+        grid = evolve(grid, dt)
+    return grid
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Domain decomposed diffusion solver')
+    parser.add_argument('--transport', type=str, default='shm', help='shm or queue')
+    parser.add_argument('--max_workers', type=int, default=cpu_count(), help='Largest number of workers')
+    parser.add_argument('--num_iterations', type=int, default=500, help='Number of steps')
+    parser.add_argument('--rows_per_worker', type=int, default=640, help='Rows of each strip in the weak scaling run')
+    parser.add_argument('--mpi', action="store_true", default=False, help='Run on MPI.COMM_WORLD with mpi4py')
+    args = parser.parse_args()
+    grid_shape = (640, 640)
+    if args.mpi:
+        run_mpi(grid_shape, args.num_iterations)
+    else:
+        solver = run_shm if args.transport == 'shm' else run_queue
+        workers = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= args.max_workers]
+
+        grid = init_grid(grid_shape)
+        start = time.time()
+        expected = run_serial(grid, args.num_iterations)
+        serial_time = time.time() - start
+        print('single process execution time: {:.2f} sec.'.format(serial_time))
+
+        print('strong scaling, grid {}, transport {}'.format(grid_shape, args.transport))
+        for nbr_workers in workers:
+            result, exec_time = solver(grid, nbr_workers, args.num_iterations)
+            assert np.array_equal(result, expected)
+            print('  {:3d} workers: {:.2f} sec., speedup {:.2f}, efficiency {:.0%}'.format(
+                nbr_workers, exec_time, serial_time / exec_time, serial_time / exec_time / nbr_workers))
+
+        print('weak scaling, {} rows per worker, transport {}'.format(args.rows_per_worker, args.transport))
+        base_time = None
+        for nbr_workers in workers:
+            weak_grid = init_grid((args.rows_per_worker * nbr_workers, grid_shape[1]))
+            result, exec_time = solver(weak_grid, nbr_workers, args.num_iterations)
+            assert np.array_equal(result, run_serial(weak_grid, args.num_iterations))
+            base_time = base_time or exec_time
+            print('  {:3d} workers, grid {}: {:.2f} sec., efficiency {:.0%}'.format(
+                nbr_workers, weak_grid.shape, exec_time, base_time / exec_time))
@@ -12,9 +12,29 @@
 # Cython will create a C version of the function that can be imported in the present script. It should 
 # execute faster than the original Python version. A C compiler must be available to Python to compile 
 # the C code.
+#
+# The module also contains a typed version of the function, calculate_z_prange(), that runs on all the
+# cores using OpenMP. It is used by setting engine='prange' when calling calc_pure_python(). The number
+# of threads can be set with the OMP_NUM_THREADS environment variable
+#
+# $ OMP_NUM_THREADS=8 python julia1.py
+#
+# A NumPy version of the function, calculate_z_numpy(), can be used instead of the Cython one by setting
+# engine='numpy' when calling calc_pure_python(). The function and z_grid(), a complex128 array version
+# of z_points() that gives the grid of the NumPy engine, are imported from ch2/julia_numpy.py. The
+# output of all the engines is drawn with show_false_greyscale_array() of ch2/julia_image.py.
 
+import array
+import os
+import sys
 import time
+import numpy as np
+from PIL import Image
 import cythonfn
+# the NumPy engine and the image functions are shared with the scripts of chapter 2
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ch2'))
+from julia_numpy import calculate_z_numpy, z_grid
+from julia_image import show_false_greyscale_array
 #-------------------------------------------------------------------------------------------------
 #                                             Initialization
 #-------------------------------------------------------------------------------------------------
@@ -24,25 +44,6 @@ desired_width=1000
 #--------------------------------------------------------------------------------------------------
 #                                             Functions 
 #--------------------------------------------------------------------------------------------------
-def show_false_greyscale(output_raw, width, height, max_iterations):
-    '''
-    Convert list to array, show using PIL
-    '''
-    # convert our output to PIL-compatible input
-    assert width * height == len(output_raw)  # sanity check our 1D array and desired 2D form
-    # rescale output_raw to be in the inclusive range [0..255]
-    max_value = float(max(output_raw))
-    output_raw_limited = [int(float(o) / max_value * 255) for o in output_raw]
-    # create a slightly fancy colour map that shows colour changes with
-    # increased contrast (thanks to John Montgomery)
-    output_rgb = ((o + (256 * o) + (256 ** 2) * o) * 16 for o in output_raw_limited)  # fancier
-    output_rgb = array.array('I', output_rgb)  # array of unsigned ints (size is platform specific)
-    # display with PIL/pillow
-    im = Image.new("RGB", (width, height))
-    # EXPLAIN RGBX L 0 -1
-    im.frombytes(output_rgb.tobytes(), "raw", "RGBX", 0, -1)
-    im.show()
-
 def show_greyscale(output_raw, width, height, max_iterations):
     '''
     Convert list to array, show using PIL
@@ -55,7 +56,7 @@ def show_greyscale(output_raw, width, height, max_iterations):
     scaled = [int(o / scale_factor * 255) for o in output_raw]
     output = array.array('B', scaled)  # array of unsigned ints
     # display with PIL
-    im = Image.new("L", (width, width))
+    im = Image.new("L", (width, height))
     # EXPLAIN RAW L 0 -1
     im.frombytes(output.tobytes(), "raw", "L", 0, -1)
     im.show()
@@ -97,12 +98,19 @@ def z_points(x1, x2, y1, y2, desired_width):
     return zs, cs, width, height
 
 
-def calc_pure_python(zs, cs, width, height, draw_output, desired_width, max_iterations):
+def calc_pure_python(zs, cs, width, height, draw_output, desired_width, max_iterations, engine='cython'):
     '''
     Create a list of complex co-ordinates (zs) and complex parameters (cs), build Julia set and display
     '''
     #start_time = time.time()
-    output = calculate_z_serial_purepython(max_iterations, zs, cs)
+    if engine == 'numpy':
+        output = calculate_z_numpy(max_iterations, zs, cs)
+    elif engine == 'prange':
+        zs = np.asarray(zs, dtype=np.complex128).ravel()
+        cs = np.broadcast_to(np.asarray(cs, dtype=np.complex128), zs.shape)
+        output = cythonfn.calculate_z_prange(max_iterations, zs, cs)
+    else:
+        output = cythonfn.calculate_z_serial_purepython(max_iterations, zs, cs)
     #end_time = time.time()
     #secs = end_time - start_time
     #print(calculate_z_serial_purepython.__name__ + " took {:.3f} seconds".format(secs))
@@ -110,7 +118,7 @@ def calc_pure_python(zs, cs, width, height, draw_output, desired_width, max_iter
     assert sum(output) == 33219980  # this sum is expected for 1000^2 grid with 300 iterations
 
     if draw_output:
-        show_false_greyscale(output, width, height, max_iterations)
+        show_false_greyscale_array(output, width, height)
         #show_greyscale(output, width, height, max_iterations)
 
 #--------------------------------------------------------------------------------------------------
@@ -126,6 +134,10 @@ if __name__ == '__main__':
     x1, x2, y1, y2 = -1.8, 1.8, -1.8, 1.8
     desired_width=1000
     c_real, c_imag = -0.62772, -.42193
-    zs, cs, width, height = z_points(x1, x2, y1, y2, desired_width)
-    print("Total elements:", len(zs))
-    calc_pure_python(zs, cs, width, height, draw_output=True, desired_width=1000, max_iterations=300)
+    engine = 'cython'  # or 'numpy', 'prange'
+    if engine in ('numpy', 'prange'):
+        zs, cs, width, height = z_grid(x1, x2, y1, y2, desired_width, c_real, c_imag)
+    else:
+        zs, cs, width, height = z_points(x1, x2, y1, y2, desired_width)
+    print("Total elements:", width * height)
+    calc_pure_python(zs, cs, width, height, draw_output=True, desired_width=1000, max_iterations=300, engine=engine)
@@ -1,3 +1,52 @@
-from distutils.core import setup
+# Build the cythonfn module in place with
+#
+# $ python setup.py build_ext --inplace
+#
+# The module is compiled with OpenMP (-fopenmp, /openmp with MSVC) so that calculate_z_prange()
+# uses all the cores. If the compiler does not support OpenMP the module is compiled without it
+# and calculate_z_prange() runs the serial kernel. Set JULIA_NO_OPENMP=1 to skip OpenMP anyway.
+import os
+import sys
+import tempfile
+from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
 from Cython.Build import cythonize
-setup(ext_modules=cythonize('cythonfn.pyx', compiler_directives={'language_level': '3'}))
\ No newline at end of file
+
+OPENMP_TEST = "#include <omp.h>\nint main(void) { return omp_get_max_threads() > 0 ? 0 : 1; }\n"
+
+def openmp_flags(compiler):
+    '''
+    Returns the compile and link flags for OpenMP, or empty lists if the compiler cannot build
+    a small OpenMP program.
+    '''
+    if os.environ.get('JULIA_NO_OPENMP'):
+        return [], []
+    if compiler.compiler_type == 'msvc':
+        return ['/openmp'], []
+    flags = ['-fopenmp']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, 'test_openmp.c')
+        with open(source, 'w') as f:
+            f.write(OPENMP_TEST)
+        try:
+            objects = compiler.compile([source], output_dir=tmpdir, extra_postargs=flags)
+            compiler.link_executable(objects, os.path.join(tmpdir, 'test_openmp'), extra_postargs=flags)
+        except Exception:
+            print('OpenMP not available, building the serial version', file=sys.stderr)
+            return [], []
+    return flags, flags
+
+class build_ext_openmp(build_ext):
+    def build_extensions(self):
+        compile_flags, link_flags = openmp_flags(self.compiler)
+        for ext in self.extensions:
+            ext.extra_compile_args += compile_flags
+            ext.extra_link_args += link_flags
+        super().build_extensions()
+
+extensions = [Extension('cythonfn', ['cythonfn.pyx'], extra_compile_args=['-O3'] if os.name != 'nt' else [])]
+
+setup(
+    ext_modules=cythonize(extensions, compiler_directives={'language_level': '3'}),
+    cmdclass={'build_ext': build_ext_openmp},
+)
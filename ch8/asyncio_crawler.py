@@ -1,6 +1,20 @@
+# This script implements an asynchronous http client of server.py. The URLs are streamed by a
+# producer into a bounded asyncio.Queue and consumed by a fixed set of workers, so the memory does
+# not grow with the number of URLs: the producer waits when the queue is full. The number of
+# requests in flight is adapted to the server with an AIMD rule (additive increase, multiplicative
+# decrease) as in the TCP congestion control: the limit grows by about one request for each round
+# trip while the responses are fast, and is halved when a request fails or its latency is above
+# the target, by default twice the smallest latency observed. Each request has a timeout and is
+# retried a few times after a random backoff (full jitter), so the retries of many workers do not
+# hit the server at the same time.
+#
+# $ python asyncio_crawler.py --num_iter 1000 --max_workers 100
+#
+import argparse
 import asyncio
 import random
 import string
+import time
 import aiohttp
 
 def generate_urls(base_url, num_urls):
@@ -8,46 +22,140 @@ def generate_urls(base_url, num_urls):
         yield base_url + "".join(random.sample(string.ascii_lowercase, 10))
 
 
-def chunked_http_client(num_chunks):
+class AIMDLimit:
     """
-    Returns a function that can fetch from a URL, ensuring that only
-    "num_chunks" of simultaneous connects are made.
+    Limit of the requests in flight, increased by increase / limit after each fast response and
+    multiplied by decrease after an error or a slow response, at most once for each round trip.
     """
-    semaphore = asyncio.Semaphore(num_chunks)  # <1>
+    def __init__(self, initial=10, minimum=1, maximum=100, increase=1.0, decrease=0.5, target_latency=None):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.min_latency = None
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
 
-    async def http_get(url, client_session):  # <2>
-        nonlocal semaphore
-        async with semaphore:
-            async with client_session.request("GET", url) as response:
-                return await response.content.read()
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
 
-    return http_get
+    async def release(self, latency, ok):
+        async with self.condition:
+            self.in_flight -= 1
+            self.update(latency, ok)
+            self.condition.notify_all()
 
+    def update(self, latency, ok):
+        if ok and (self.min_latency is None or latency < self.min_latency):
+            self.min_latency = latency
+        target = self.target_latency or 2 * (self.min_latency or latency)
+        if ok and latency <= target:
+            self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            return
+        # a burst of slow responses is a single congestion event
+        now = time.monotonic()
+        if now - self.last_decrease > (self.min_latency or latency):
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self.last_decrease = now
 
-async def run_experiment(base_url, num_iter=1000):
+
+async def fetch(url, client_session, limit, timeout=10.0, retries=3, backoff=0.1, stats=None):
+    """
+    Returns the body of the response, retrying after a timeout or an error of the connection
+    """
+    for attempt in range(retries + 1):
+        await limit.acquire()
+        start = time.perf_counter()
+        try:
+            async with client_session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response.raise_for_status()
+                data = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            await limit.release(time.perf_counter() - start, ok=False)
+            if stats is not None:
+                stats['errors'] += 1
+            if attempt == retries:
+                raise
+            await asyncio.sleep(random.uniform(0, backoff * 2 ** attempt))
+        else:
+            latency = time.perf_counter() - start
+            await limit.release(latency, ok=True)
+            if stats is not None:
+                stats['requests'] += 1
+                stats['latency_sum'] += latency
+                stats['latency_max'] = max(stats['latency_max'], latency)
+            return data
+
+
+async def produce(urls, queue, num_workers):
+    for url in urls:
+        await queue.put(url)  # waits while the queue is full
+    for i in range(num_workers):
+        await queue.put(None)
+
+
+async def consume(queue, client_session, limit, results, **fetch_args):
+    while True:
+        url = await queue.get()
+        if url is None:
+            return
+        try:
+            data = await fetch(url, client_session, limit, **fetch_args)
+            results['responses_sum'] += len(data)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            results['failed'] += 1
+
+
+async def crawl(urls, max_workers=100, initial_limit=10, timeout=10.0, retries=3, target_latency=None, stats=None):
+    """
+    Fetch the urls with max_workers workers and an adaptive limit of the requests in flight.
+    Returns the total size of the responses. If stats is a dict it gets the number of successful
+    requests, the sum and the maximum of their latencies, the number of errors and failed urls and
+    the final limit. Only these totals are kept, not the latency of each url.
+    """
+    queue = asyncio.Queue(maxsize=2 * max_workers)
+    limit = AIMDLimit(initial_limit, maximum=max_workers, target_latency=target_latency)
+    results = {'responses_sum': 0, 'failed': 0}
+    fetch_stats = {'requests': 0, 'latency_sum': 0.0, 'latency_max': 0.0, 'errors': 0}
+    connector = aiohttp.TCPConnector(limit=max_workers)
+    async with aiohttp.ClientSession(connector=connector) as client_session:
+        workers = [asyncio.create_task(consume(queue, client_session, limit, results, timeout=timeout,
+                                               retries=retries, stats=fetch_stats))
+                   for i in range(max_workers)]
+        await produce(urls, queue, max_workers)
+        await asyncio.gather(*workers)
+    if stats is not None:
+        stats.update(fetch_stats, failed=results['failed'], limit=limit.limit)
+    return results['responses_sum']
+
+
+async def run_experiment(base_url, num_iter=1000, max_workers=100, stats=None):
     urls = generate_urls(base_url, num_iter)
-    http_client = chunked_http_client(100)
-    responses_sum = 0
-    async with aiohttp.ClientSession() as client_session:
-        tasks = [http_client(url, client_session) for url in urls]  # <3>
-        for future in asyncio.as_completed(tasks):  # <4>
-            data = await future
-            responses_sum += len(data)
-    return responses_sum
+    return await crawl(urls, max_workers, stats=stats)
 
 
 if __name__ == "__main__":
-    import time
-
-    loop = asyncio.get_event_loop()
-    delay = 100
-    num_iter = 1000
+    parser = argparse.ArgumentParser(description='Asynchronous HTTP client of server.py')
+    parser.add_argument('--num_iter', type=int, default=1000, help='Number of requests')
+    parser.add_argument('--delay', type=int, default=100, help='Delay of the server, ms')
+    parser.add_argument('--max_workers', type=int, default=100, help='Maximum number of requests in flight')
+    args = parser.parse_args()
 
+    stats = {}
     start = time.time()
-    result = loop.run_until_complete(
+    result = asyncio.run(
         run_experiment(
-            f"http://127.0.0.1:8080/add?name=asyncio&delay={delay}&", num_iter
+            f"http://127.0.0.1:8080/add?name=asyncio&delay={args.delay}&", args.num_iter, args.max_workers, stats
         )
     )
     end = time.time()
-    print(f"Result: {result}, Time: {end - start}")
\ No newline at end of file
+    print(f"Result: {result}, Time: {end - start}")
+    print("Errors: {}, failed: {}, final limit: {:.1f}".format(stats['errors'], stats['failed'], stats['limit']))
+    if stats['requests']:
+        print("Latency mean: {:.1f} ms, max: {:.1f} ms".format(
+            stats['latency_sum'] / stats['requests'] * 1000, stats['latency_max'] * 1000))
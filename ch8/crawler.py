@@ -4,11 +4,26 @@
 # the server how long it should keep the synchronous connection before returning the control 
 # to the client. The client will wait for the connection to be closed before sending a new 
 # request.
+#
+# The threaded client sends the requests from a pool of threads that share one requests.Session,
+# so the TCP connections are kept alive and reused instead of being opened for each request. The
+# connection pool of the session has at most max_per_host connections for each host, the threads
+# that find all of them in use wait for one to be released. The URLs are submitted to the pool a
+# few at a time and the results are streamed by a generator as soon as they are ready, so the
+# number of pending requests stays bounded. The client prints the p50, p95 and p99 latency and
+# the number of requests per second
+#
+# $ python crawler.py --threads 20 --max_per_host 20
+#
+import argparse
 import os
 import threading
 import random
 import string
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import requests
+from requests.adapters import HTTPAdapter
 
 def threads_info():
     total_threads = threading.active_count()
@@ -32,16 +47,83 @@ def run_experiment(base_url, num_iter=1000):
         response_size += len(response.text)
     return response_size
 
+def make_session(max_per_host=10):
+    '''
+    Session with a pool of at most max_per_host connections for each host. With pool_block the
+    threads wait for a free connection instead of opening more.
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=max_per_host, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def fetch(session, url):
+    start = time.perf_counter()
+    response = session.get(url)
+    return len(response.text), time.perf_counter() - start
+
+def crawl_threaded(urls, session, num_threads=10):
+    '''
+    Yields the size of the response and the latency of each url, in order of completion. At most
+    2 * num_threads requests are pending at any time.
+    '''
+    urls = iter(urls)
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        pending = set()
+        for url in urls:
+            pending.add(executor.submit(fetch, session, url))
+            if len(pending) >= 2 * num_threads:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+def latency_percentiles(latencies, quantiles=(0.5, 0.95, 0.99)):
+    ordered = sorted(latencies)
+    return [ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in quantiles]
+
+def run_experiment_threaded(base_url, num_iter=1000, num_threads=10, max_per_host=10, stats=None):
+    '''
+    Same as run_experiment() with a pool of threads sharing one session. If stats is a dict it gets
+    the latencies of the requests.
+    '''
+    response_size = 0
+    latencies = []
+    with make_session(max_per_host) as session:
+        for size, latency in crawl_threaded(generate_urls(base_url, num_iter), session, num_threads):
+            response_size += size
+            latencies.append(latency)
+    if stats is not None:
+        stats['latencies'] = latencies
+    return response_size
+
 
 if __name__ == "__main__":
-    import time
+    parser = argparse.ArgumentParser(description='HTTP client of server.py')
+    parser.add_argument('--num_iter', type=int, default=100, help='Number of requests')
+    parser.add_argument('--delay', type=int, default=100, help='Delay of the server, ms')
+    parser.add_argument('--threads', type=int, default=0, help='Number of threads, 0 for the serial client')
+    parser.add_argument('--max_per_host', type=int, default=None, help='Connections for each host, default threads')
+    args = parser.parse_args()
+
     threads_info()
-    delay = 100
-    num_iter = 100
-    base_url = f'http://127.0.0.1:8080/add?name=serial&delay={delay}&'
+    delay = args.delay
+    num_iter = args.num_iter
+    name = 'threaded' if args.threads else 'serial'
+    base_url = f'http://127.0.0.1:8080/add?name={name}&delay={delay}&'
     print(f'Sending: {num_iter} request to http://127.0.0.1:8080 with delay {delay} ms.')
+    stats = {}
     start = time.time()
-    result = run_experiment(base_url, num_iter)
+    if args.threads:
+        result = run_experiment_threaded(base_url, num_iter, args.threads, args.max_per_host or args.threads, stats)
+    else:
+        result = run_experiment(base_url, num_iter)
     end = time.time()
     exec_time = end - start
-    print('Result: {:d}, Time: {:.1f} sec.'.format(result, exec_time))
\ No newline at end of file
+    print('Result: {:d}, Time: {:.1f} sec.'.format(result, exec_time))
+    if stats:
+        p50, p95, p99 = latency_percentiles(stats['latencies'])
+        print('Latency p50: {:.1f} ms, p95: {:.1f} ms, p99: {:.1f} ms, {:.1f} requests/sec'.format(
+            p50 * 1000, p95 * 1000, p99 * 1000, num_iter / exec_time))
\ No newline at end of file
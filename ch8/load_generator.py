@@ -0,0 +1,137 @@
+# This script is an open-loop load generator for server.py. The clients crawler.py and
+# asyncio_crawler.py are closed-loop: a new request is sent only when a previous one has completed,
+# so when the server slows down the clients slow down too and send fewer requests, and the
+# latencies they measure hide the time the requests would have waited (coordinated omission).
+# Here the requests are sent at a target arrival rate, at constant intervals or with exponential
+# intervals (a Poisson process), whatever the state of the previous requests. For each request the
+# intended send time of the schedule and the actual send time are recorded. The service latency
+# is measured from the actual send time, the corrected latency from the intended send time, which
+# includes the delay of the client when it falls behind the schedule. The script prints the
+# percentiles of both latencies and the number of requests sent and completed in each second.
+#
+# $ python load_generator.py --rate 200 --duration 10 --arrival poisson
+#
+# Several rates can be given to find the saturation point of the server, where the throughput
+# stops following the rate and the corrected latencies grow
+#
+# $ python load_generator.py --rate 100 200 400 800 --duration 5
+#
+import argparse
+import asyncio
+import json
+import random
+import time
+import aiohttp
+from asyncio_crawler import generate_urls
+from crawler import latency_percentiles
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def arrival_times(rate, duration, arrival='constant'):
+    """
+    Intended send times, in seconds from the start, of the requests in [0, duration)
+    """
+    t = 0.0
+    while t < duration:
+        yield t
+        t += random.expovariate(rate) if arrival == 'poisson' else 1.0 / rate
+
+
+async def send(client_session, url, intended, timeout, records):
+    # the request is sent when the task runs, later than its creation if the event loop is behind
+    actual = time.perf_counter()
+    try:
+        async with client_session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            await response.read()
+            ok = response.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        ok = False
+    records.append((intended, actual, time.perf_counter(), ok))
+
+
+async def run_load(base_url, rate, duration, arrival='constant', timeout=10.0):
+    """
+    Send requests at the given rate for duration seconds. Returns a list with the intended send
+    time, the actual send time, the end time and the success of each request, relative to the start.
+    """
+    records = []
+    tasks = set()
+    urls = generate_urls(base_url, int(rate * duration * 10) + 100)
+    connector = aiohttp.TCPConnector(limit=0)  # open loop, no limit of the connections
+    async with aiohttp.ClientSession(connector=connector) as client_session:
+        start = time.perf_counter()
+        for offset, url in zip(arrival_times(rate, duration, arrival), urls):
+            intended = start + offset
+            wait = intended - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            task = asyncio.create_task(send(client_session, url, intended, timeout, records))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    return [(intended - start, actual - start, end - start, ok) for intended, actual, end, ok in records]
+
+
+def summarize(records, duration):
+    """
+    Percentiles of the service and corrected latencies and of the send lag in ms, and the
+    requests sent, completed and failed in each second
+    """
+    ok_records = [r for r in records if r[3]]
+    service = [end - actual for intended, actual, end, ok in ok_records] or [0.0]
+    corrected = [end - intended for intended, actual, end, ok in ok_records] or [0.0]
+    lag = [actual - intended for intended, actual, end, ok in records] or [0.0]
+    nbr_seconds = int(max([duration] + [end for _, _, end, _ in records])) + 1
+    timeline = [{'second': s, 'sent': 0, 'completed': 0, 'failed': 0} for s in range(nbr_seconds)]
+    for intended, actual, end, ok in records:
+        timeline[int(actual)]['sent'] += 1
+        timeline[int(end)]['completed' if ok else 'failed'] += 1
+    last_end = max([end for _, _, end, _ in records] or [duration])
+    return {
+        'requests': len(records),
+        'failed': len(records) - len(ok_records),
+        'throughput': len(ok_records) / last_end,
+        'service_ms': dict(zip(QUANTILES, [v * 1e3 for v in latency_percentiles(service, QUANTILES)])),
+        'corrected_ms': dict(zip(QUANTILES, [v * 1e3 for v in latency_percentiles(corrected, QUANTILES)])),
+        'max_corrected_ms': max(corrected) * 1e3,
+        'send_lag_ms': {'p99': latency_percentiles(lag, (0.99,))[0] * 1e3, 'max': max(lag) * 1e3},
+        'timeline': timeline,
+    }
+
+
+def print_summary(rate, summary, show_timeline=True):
+    print('Rate {:.0f}/s: {} requests, {} failed, throughput {:.1f}/s, send lag p99 {:.1f} ms, max {:.1f} ms'.format(
+        rate, summary['requests'], summary['failed'], summary['throughput'],
+        summary['send_lag_ms']['p99'], summary['send_lag_ms']['max']))
+    print('  {:12s} {}'.format('latency ms', ' '.join('{:>9s}'.format('p{:g}'.format(q * 100)) for q in QUANTILES)))
+    for key, label in (('service_ms', 'service'), ('corrected_ms', 'corrected')):
+        print('  {:12s} {}'.format(label, ' '.join('{:9.1f}'.format(summary[key][q]) for q in QUANTILES)))
+    if show_timeline:
+        print('  {:>6s} {:>8s} {:>10s} {:>8s}'.format('second', 'sent', 'completed', 'failed'))
+        for row in summary['timeline']:
+            print('  {second:6d} {sent:8d} {completed:10d} {failed:8d}'.format(**row))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Open-loop load generator for server.py')
+    parser.add_argument('--rate', type=float, nargs='+', default=[100.0], help='Requests per second, one run for each rate')
+    parser.add_argument('--duration', type=float, default=10.0, help='Duration of each run, seconds')
+    parser.add_argument('--arrival', choices=('constant', 'poisson'), default='constant', help='Intervals between the requests')
+    parser.add_argument('--delay', type=int, default=100, help='Delay of the server, ms')
+    parser.add_argument('--timeout', type=float, default=10.0, help='Timeout of each request, seconds')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the Poisson arrivals')
+    parser.add_argument('--output', type=str, default=None, help='JSON file for the summaries')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    base_url = f'http://127.0.0.1:8080/add?name=load&delay={args.delay}&'
+    results = []
+    for rate in args.rate:
+        records = asyncio.run(run_load(base_url, rate, args.duration, args.arrival, args.timeout))
+        summary = summarize(records, args.duration)
+        print_summary(rate, summary, show_timeline=len(args.rate) == 1)
+        results.append(dict(summary, rate=rate))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -19,38 +19,360 @@
 #
 # $ taskkill /PID 2068 /F
 #
+# The timings of the requests are kept for each name in a ring buffer of fixed size, two arrays
+# of floats with the start and end times, so the memory used by the server does not grow with the
+# number of requests: the buffer grows with the first timings up to its size, then the oldest
+# timings are overwritten. The number of names is limited too, a request with a new name beyond
+# the limit gets the error 400. A request with
+# flush=1 appends the timings recorded since the previous flush to a newline-delimited JSON file,
+# one record for each line. The event loop only takes the range of indexes to flush of each
+# buffer, the timings are copied from the buffers in slices and written to the file by a thread,
+# so the server keeps answering the requests during the flush.
+#
+# On Linux and macOS the server can run in several processes that listen on the same port with
+# SO_REUSEPORT, the kernel spreads the connections among them. Each process has its own buffers
+# and writes its own file, metric_data.<process number>.ndjson
+#
+# $ python server.py --processes=4
+#
+# The latencies are also aggregated online for each name in a histogram with 16 linear
+# sub-buckets for each power of two microseconds, as in HdrHistogram, so the quantiles have a
+# relative error below 1/16 and are computed walking the buckets once, without the raw timings.
+# The mean and the variance are updated with Welford's algorithm. The endpoint /stats returns
+# the count, mean, standard deviation, minimum, maximum and quantiles in milliseconds of each
+# name, or only of one name. With several processes the histograms are in shared memory, each
+# process updates its own histograms and /stats merges those of all the processes
+#
+# $ curl "http://127.0.0.1:8080/stats?name=serial&q=0.5,0.99"
+#
 
 import json
+import mmap
+import multiprocessing
 import time
-from collections import defaultdict
-from tornado import gen, httpserver, ioloop, options, web
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen, httpserver, ioloop, netutil, options, process, web
 import os
 import threading
 
 options.define("port", default=8080, help="Port to serve on")
+options.define("processes", default=1, help="Number of server processes, 0 for one for each CPU")
+options.define("ring_size", default=100000, help="Number of timings kept for each name")
+options.define("max_names", default=1000, help="Largest number of metric names")
+options.define("metric_file", default="metric_data.ndjson", help="File of the flushed timings")
+
+
+class MetricRing:
+    """
+    Last size start and end times of the requests with a name, the arrays grow up to size
+    """
+    def __init__(self, size):
+        self.size = size
+        self.starts = array("d")
+        self.ends = array("d")
+        self.total = 0  # number of timings ever added
+        self.flushed = 0  # number of timings already flushed or overwritten
+
+    def add(self, start, end):
+        if self.total < self.size:
+            self.starts.append(start)
+            self.ends.append(end)
+        else:
+            i = self.total % self.size
+            self.starts[i] = start
+            self.ends[i] = end
+        self.total += 1
+
+    def claim(self):
+        """
+        Range [first, last) of the timings added since the last call, and the number of timings
+        overwritten before they could be flushed. Only the indexes are taken here, the timings
+        are copied by read() in the flush thread.
+        """
+        first = max(self.flushed, self.total - self.size)
+        dropped = first - self.flushed
+        self.flushed = self.total
+        return first, self.total, dropped
+
+    def read(self, first, last, chunk_size=10000):
+        """
+        Yields the start and end times of the timings in [first, last), in slices of at most
+        chunk_size, and the number of timings of each slice that have been overwritten by the
+        event loop in the meantime and are skipped
+        """
+        k = first
+        while k < last:
+            i = k % self.size
+            n = min(last - k, chunk_size, self.size - i)  # a slice does not wrap around
+            starts = self.starts[i:i + n]
+            ends = self.ends[i:i + n]
+            # the timing k is overwritten when size more timings have been added after it
+            skipped = min(max(self.total - self.size - k, 0), n)
+            yield starts[skipped:], ends[skipped:], skipped
+            k += n
+
+
+class LatencyHistogram:
+    """
+    Counts of the latencies in buckets of powers of two microseconds, each split in SUB_BUCKETS
+    linear sub-buckets, and running mean and variance of the latencies (Welford's algorithm). The
+    counts and the moments (count, mean, m2, min, max) can be views of shared memory.
+    """
+    SUB_BITS = 4
+    SUB_BUCKETS = 2 ** SUB_BITS
+    NBR_BUCKETS = 40 * SUB_BUCKETS  # up to 2^40 us, about 12 days
+    NBR_MOMENTS = 5
+
+    def __init__(self, counts=None, moments=None):
+        self.counts = array("q", bytes(8 * self.NBR_BUCKETS)) if counts is None else counts
+        self.moments = array("d", bytes(8 * self.NBR_MOMENTS)) if moments is None else moments
+
+    @property
+    def count(self):
+        return int(self.moments[0])
+
+    @property
+    def mean(self):
+        return self.moments[1]
+
+    @property
+    def m2(self):
+        # sum of the squared differences from the mean
+        return self.moments[2]
+
+    @property
+    def min(self):
+        return self.moments[3]
+
+    @property
+    def max(self):
+        return self.moments[4]
+
+    @classmethod
+    def bucket(cls, dt_us):
+        # values below 2 * SUB_BUCKETS have a bucket each, then SUB_BUCKETS for each power of two
+        shift = max(dt_us.bit_length() - cls.SUB_BITS - 1, 0)
+        return min(shift * cls.SUB_BUCKETS + (dt_us >> shift), cls.NBR_BUCKETS - 1)
+
+    @classmethod
+    def bucket_range(cls, index):
+        shift = max(index // cls.SUB_BUCKETS - 1, 0)
+        top = index - shift * cls.SUB_BUCKETS
+        return top << shift, (top + 1) << shift
+
+    def add(self, dt):
+        self.counts[self.bucket(int(dt * 1e6))] += 1
+        count, mean, m2, low, high = self.moments
+        count += 1
+        delta = dt - mean
+        mean += delta / count
+        m2 += delta * (dt - mean)
+        if count == 1 or dt < low:
+            low = dt
+        high = max(high, dt)
+        self.moments[0:5] = array("d", (count, mean, m2, low, high))
+
+    def merge(self, other):
+        """
+        Add the counts and the moments of other (Chan's parallel algorithm)
+        """
+        if other.count == 0:
+            return
+        for index, bucket_count in enumerate(other.counts):
+            if bucket_count:
+                self.counts[index] += bucket_count
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.count / count
+        m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / count
+        low = other.min if self.count == 0 else min(self.min, other.min)
+        self.moments[0:5] = array("d", (count, mean, m2, low, max(self.max, other.max)))
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def quantiles(self, qs):
+        """
+        Latencies of the quantiles qs in seconds, the middle of the bucket of each quantile
+        """
+        results = {}
+        pending = sorted(qs)
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            while pending and seen >= pending[0] * self.count and bucket_count:
+                low, high = self.bucket_range(index)
+                value = (low + high) / 2e6
+                results[pending.pop(0)] = min(max(value, self.min), self.max)
+            if not pending:
+                break
+        return results
+
+    def to_dict(self, qs):
+        stats = {"count": self.count, "mean_ms": self.mean * 1e3, "std_ms": self.variance() ** 0.5 * 1e3,
+                 "min_ms": self.min * 1e3, "max_ms": self.max * 1e3}
+        for q, value in self.quantiles(qs).items():
+            stats["p{:g}".format(q * 100)] = value * 1e3
+        return stats
+
+
+class SharedMetrics:
+    """
+    Latency histograms of at most max_names names for nbr_shards server processes, in memory
+    shared by the processes that must be allocated before the fork. The names are registered in a
+    shared table under a lock, then each process adds its latencies to its own shard without locks
+    and histogram() merges the shards of all the processes.
+    """
+    NAME_BYTES = 64
+
+    def __init__(self, max_names, nbr_shards=1):
+        self.max_names = max_names
+        self.nbr_shards = nbr_shards
+        self.shard = 0  # shard of this process, set after the fork
+        self.lock = multiprocessing.Lock()
+        self.nbr_names = multiprocessing.RawValue("i", 0)
+        # anonymous shared mappings, inherited by the forked processes and zero-filled lazily
+        self.names = mmap.mmap(-1, max_names * self.NAME_BYTES)
+        nbr_histograms = nbr_shards * max_names
+        self.counts = memoryview(mmap.mmap(-1, 8 * nbr_histograms * LatencyHistogram.NBR_BUCKETS)).cast("q")
+        self.moments = memoryview(mmap.mmap(-1, 8 * nbr_histograms * LatencyHistogram.NBR_MOMENTS)).cast("d")
+        self.slots = {}  # name -> slot, cache of the table in this process
+
+    def shard_histogram(self, shard, slot):
+        i = shard * self.max_names + slot
+        nbr_buckets, nbr_moments = LatencyHistogram.NBR_BUCKETS, LatencyHistogram.NBR_MOMENTS
+        return LatencyHistogram(self.counts[i * nbr_buckets:(i + 1) * nbr_buckets],
+                                self.moments[i * nbr_moments:(i + 1) * nbr_moments])
+
+    def refresh(self):
+        # names registered by the other processes
+        for slot in range(len(self.slots), self.nbr_names.value):
+            name = self.names[slot * self.NAME_BYTES:(slot + 1) * self.NAME_BYTES].rstrip(b"\0")
+            self.slots[name.decode()] = slot
+
+    def slot(self, name, create=False):
+        """
+        Slot of name in the table, registered if create is true. None if the name is unknown or the
+        table is full.
+        """
+        if name not in self.slots:
+            self.refresh()
+        if name in self.slots or not create:
+            return self.slots.get(name)
+        encoded = name.encode()
+        if len(encoded) > self.NAME_BYTES:
+            raise ValueError("names are at most {} bytes".format(self.NAME_BYTES))
+        with self.lock:
+            self.refresh()
+            if name in self.slots:
+                return self.slots[name]
+            slot = self.nbr_names.value
+            if slot >= self.max_names:
+                return None
+            self.names[slot * self.NAME_BYTES:slot * self.NAME_BYTES + len(encoded)] = encoded
+            self.nbr_names.value = slot + 1
+            self.slots[name] = slot
+            return slot
+
+    def add(self, slot, dt):
+        self.shard_histogram(self.shard, slot).add(dt)
+
+    def histogram(self, slot):
+        merged = LatencyHistogram()
+        for shard in range(self.nbr_shards):
+            merged.merge(self.shard_histogram(shard, slot))
+        return merged
+
+    def all_names(self):
+        self.refresh()
+        return dict(self.slots)
+
+
+def write_records(filename, claims):
+    """
+    Append the timings of the claimed ranges (name, ring, first, last) to the file. Runs in the
+    flush thread. Returns the number of timings written and skipped.
+    """
+    written = skipped = 0
+    with open(filename, "a") as f:
+        for name, ring, first, last in claims:
+            for starts, ends, nbr_skipped in ring.read(first, last):
+                f.writelines(json.dumps({"name": name, "start": start, "end": end, "dt": end - start}) + "\n"
+                             for start, end in zip(starts, ends))
+                written += len(starts)
+                skipped += nbr_skipped
+    return written, skipped
 
 
 class AddMetric(web.RequestHandler):
-    metric_data = defaultdict(list)
+    metric_data = {}
+    metrics = None  # SharedMetrics, created before the fork
+    ring_size = 100000
+    metric_file = "metric_data.ndjson"
+    # one thread, the flushes are appended to the file in order
+    flush_executor = ThreadPoolExecutor(max_workers=1)
+
+    async def flush_metrics(self):
+        # only the ranges of indexes are taken in the event loop
+        claims = []
+        dropped = 0
+        for name, ring in self.metric_data.items():
+            first, last, ring_dropped = ring.claim()
+            if last > first:
+                claims.append((name, ring, first, last))
+            dropped += ring_dropped
+        written, skipped = await ioloop.IOLoop.current().run_in_executor(
+            self.flush_executor, write_records, self.metric_file, claims)
+        self.write({"written": written, "dropped": dropped + skipped})
 
     async def get(self):
         if self.get_argument("flush", False):
-            json.dump(self.metric_data, open("metric_data.json", "w+"))
+            await self.flush_metrics()
         else:
             name = self.get_argument("name")
             try:
                 delay = int(self.get_argument("delay", 1024))
             except ValueError:
                 raise web.HTTPError(400, reason="Invalid value for delay")
+            try:
+                slot = self.metrics.slot(name, create=True)
+            except ValueError:
+                raise web.HTTPError(400, reason="Metric name too long")
+            if slot is None:
+                raise web.HTTPError(400, reason="Too many metric names")
 
             start = time.time()
             await gen.sleep(delay / 1000.0)
             self.write(".")
             self.finish()
             end = time.time()
-            self.metric_data[name].append(
-                {"start": start, "end": end, "dt": end - start}
-            )
+            ring = self.metric_data.get(name)
+            if ring is None:
+                ring = self.metric_data[name] = MetricRing(self.ring_size)
+            ring.add(start, end)
+            self.metrics.add(slot, end - start)
+
+
+class Stats(web.RequestHandler):
+    def get(self):
+        try:
+            qs = [float(q) for q in self.get_argument("q", "0.5,0.9,0.99,0.999").split(",")]
+        except ValueError:
+            raise web.HTTPError(400, reason="Invalid value for q")
+        if not all(0 <= q <= 1 for q in qs):
+            raise web.HTTPError(400, reason="Quantiles must be between 0 and 1")
+        metrics = AddMetric.metrics
+        name = self.get_argument("name", None)
+        if name is None:
+            slots = metrics.all_names()
+        elif metrics.slot(name) is not None:
+            slots = {name: metrics.slot(name)}
+        else:
+            raise web.HTTPError(404, reason="Unknown name")
+        self.write({"processes": metrics.nbr_shards,
+                    "metrics": {key: metrics.histogram(slot).to_dict(qs) for key, slot in slots.items()}})
+
 def threads_info():
     total_threads = threading.active_count()
     thread_name = threading.current_thread().name
@@ -61,11 +383,26 @@ def threads_info():
 if __name__ == "__main__":
     options.parse_command_line()
     port = options.options.port
+    AddMetric.ring_size = options.options.ring_size
+    AddMetric.metric_file = options.options.metric_file
+
+    nbr_processes = options.options.processes or process.cpu_count()
+    AddMetric.metrics = SharedMetrics(options.options.max_names, nbr_processes)
+
+    if nbr_processes == 1:
+        sockets = netutil.bind_sockets(port)
+    else:
+        # the IOLoop must be created after the fork, each process binds its own socket
+        process.fork_processes(nbr_processes)
+        AddMetric.metrics.shard = process.task_id()
+        root, ext = os.path.splitext(AddMetric.metric_file)
+        AddMetric.metric_file = "{}.{}{}".format(root, process.task_id(), ext)
+        sockets = netutil.bind_sockets(port, reuse_port=True)
 
-    application = web.Application([(r"/add", AddMetric)])
+    application = web.Application([(r"/add", AddMetric), (r"/stats", Stats)])
 
     http_server = httpserver.HTTPServer(application)
-    http_server.listen(port)
+    http_server.add_sockets(sockets)
     threads_info()
     print(("Listening on port: {}".format(port)))
-    ioloop.IOLoop.instance().start()
\ No newline at end of file
+    ioloop.IOLoop.current().start()
\ No newline at end of file
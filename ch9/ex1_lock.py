@@ -1,27 +1,59 @@
+import argparse
 import multiprocessing
 import os
+import time
+from multiprocessing import shared_memory
 import fasteners
+try:
+    import posix_ipc
+except ImportError:
+    posix_ipc = None
 # python -m timeit -s "import ex1_lock" "ex1_lock.run_workers()"
 # 400ms
+#
+# The counter can also be kept in memory, without files and without locks. With the sharded
+# backend each process has its own slot in a block of shared memory and increments only that
+# slot, so no lock is needed; the value of the counter is the sum of the slots. Each slot is
+# padded to 64 bytes, the size of a cache line, so that two processes never write in the same
+# cache line (false sharing). The value backend uses a multiprocessing.Value with its lock, for
+# comparison. The backend is the first argument of the script
+#
+# $ python ex1_lock.py sharded
+#
+# The size of the critical section is measured by a contention benchmark. The processes add to a
+# counter in shared memory protected by a lock, taken for each increment (increment mode), every
+# K increments accumulated locally (batch mode) or once for the whole job (job mode). The lock is
+# a fasteners file lock, a multiprocessing.Lock or a named POSIX semaphore of the posix_ipc
+# package, skipped if the package is not installed. The benchmark prints the throughput and the
+# latency of the acquisition of the lock for each mode and lock type
+#
+# $ python ex1_lock.py --contention --batch 100
 
 
 MAX_COUNT_PER_PROCESS = 1000
 FILENAME = "count.txt"
 
 
-def work_smaller_chunks(filename, max_count):
-    @fasteners.interprocess_locked('/tmp/tmp_lock')
-    def work_write(filename):
-        f = open(filename, "r")
+CACHE_LINE = 64
+SLOT_STRIDE = CACHE_LINE // 8  # number of int64 in a cache line
+
+
+def read_count(filename):
+    with open(filename, "r") as f:
         try:
-            nbr = int(f.read())
+            return int(f.read())
         except ValueError as err:
             print("File is empty, starting to count from 0, error: " + str(err))
-            nbr = 0
+            return 0
+
+
+def work_smaller_chunks(filename, max_count):
+    @fasteners.interprocess_locked('/tmp/tmp_lock')
+    def work_write(filename):
+        nbr = read_count(filename)
         #print(os.getpid())
-        f = open(filename, "w")
-        f.write(str(nbr + 1) + '\n')
-        f.close()
+        with open(filename, "w") as f:
+            f.write(str(nbr + 1) + '\n')
 
     for n in range(max_count):
         work_write(filename)
@@ -29,38 +61,200 @@ def work_smaller_chunks(filename, max_count):
 @fasteners.interprocess_locked('/tmp/tmp_lock')
 def work(filename, max_count):
     for n in range(max_count):
-        f = open(filename, "r")
+        nbr = read_count(filename)
+        with open(filename, "w") as f:
+            f.write(str(nbr + 1) + '\n')
+
+
+def work_sharded(shm_name, slot, max_count):
+    """Increment our own slot of the shared counter, no lock is needed"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    counts = shm.buf.cast('q')
+    index = slot * SLOT_STRIDE
+    for n in range(max_count):
+        counts[index] += 1
+    counts.release()
+    shm.close()
+
+
+def sharded_count(shm, nbr_slots):
+    """Value of the counter, sum of the slots of all the processes"""
+    counts = shm.buf.cast('q')
+    total = sum(counts[slot * SLOT_STRIDE] for slot in range(nbr_slots))
+    counts.release()
+    return total
+
+
+def work_value(value, max_count):
+    """Increment a shared multiprocessing.Value holding its lock"""
+    for n in range(max_count):
+        with value.get_lock():
+            value.value += 1
+
+
+LOCK_TYPES = ('file', 'lock', 'semaphore')
+MODES = ('increment', 'batch', 'job')
+
+
+class NamedSemaphore:
+    """
+    Named POSIX semaphore with an initial value of 1. Only the name is sent to the worker
+    processes, each one opens the semaphore the first time it is used.
+    """
+    def __init__(self, name):
+        self.name = name
+        posix_ipc.Semaphore(name, posix_ipc.O_CREX, initial_value=1).close()
+        self.semaphore = None
+
+    def __getstate__(self):
+        return {'name': self.name, 'semaphore': None}
+
+    def acquire(self):
+        if self.semaphore is None:
+            self.semaphore = posix_ipc.Semaphore(self.name)
+        self.semaphore.acquire()
+
+    def release(self):
+        self.semaphore.release()
+
+    def unlink(self):
+        posix_ipc.unlink_semaphore(self.name)
+
+
+def make_lock(lock_type):
+    if lock_type == 'file':
+        return fasteners.InterProcessLock('/tmp/tmp_lock')
+    if lock_type == 'lock':
+        return multiprocessing.Lock()
+    if lock_type == 'semaphore':
+        return NamedSemaphore('/ex1_lock_{}'.format(os.getpid()))
+    raise ValueError("Unknown lock type: {}".format(lock_type))
+
+
+def work_contention(lock, counter, mode, max_count, batch, latencies):
+    """Add max_count to the counter, taking the lock as the mode says, and send the acquisition times"""
+    acquire_ns = []
+    if mode == 'job':
+        start = time.perf_counter_ns()
+        lock.acquire()
+        acquire_ns.append(time.perf_counter_ns() - start)
         try:
-            nbr = int(f.read())
-        except ValueError as err:
-            print("File is empty, starting to count from 0, error: " + str(err))
-            nbr = 0
-        f = open(filename, "w")
-        f.write(str(nbr + 1) + '\n')
-        f.close()
+            for n in range(max_count):
+                counter.value += 1
+        finally:
+            lock.release()
+    else:
+        batch = 1 if mode == 'increment' else batch
+        local = 0
+        for n in range(max_count):
+            local += 1
+            if local == batch or n == max_count - 1:
+                start = time.perf_counter_ns()
+                lock.acquire()
+                acquire_ns.append(time.perf_counter_ns() - start)
+                try:
+                    counter.value += local
+                finally:
+                    lock.release()
+                local = 0
+    latencies.put(acquire_ns)
+
 
+def percentile(sorted_values, q):
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
 
-def run_workers():
-    NBR_PROCESSES = 4
-    total_expected_count = NBR_PROCESSES * MAX_COUNT_PER_PROCESS
-    print("Starting {} process(es) to count to {}".format(NBR_PROCESSES, total_expected_count))
-    # reset counter
-    f = open(FILENAME, "w")
-    f.close()
+
+def run_contention(mode, lock_type, nbr_processes=4, max_count=100_000, batch=100):
+    """Returns the increments per second and the sorted acquisition times in ns"""
+    lock = make_lock(lock_type)
+    counter = multiprocessing.RawValue('q', 0)  # protected by lock only
+    latencies = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=work_contention,
+                                         args=(lock, counter, mode, max_count, batch, latencies))
+                 for process_nbr in range(nbr_processes)]
+    start = time.perf_counter()
+    for p in processes:
+        p.start()
+    acquire_ns = []
+    for p in processes:
+        acquire_ns.extend(latencies.get())  # before join(), the queue must be drained
+    for p in processes:
+        p.join()
+    exec_time = time.perf_counter() - start
+    if lock_type == 'semaphore':
+        lock.unlink()
+    assert counter.value == nbr_processes * max_count
+    return nbr_processes * max_count / exec_time, sorted(acquire_ns)
+
+
+def print_contention(nbr_processes, max_count, batch):
+    lock_types = LOCK_TYPES
+    if posix_ipc is None:
+        print("posix_ipc is not installed, the POSIX semaphore is skipped")
+        lock_types = tuple(lock_type for lock_type in LOCK_TYPES if lock_type != 'semaphore')
+    print("{} processes, {} increments each, batch of {}".format(nbr_processes, max_count, batch))
+    print("{:10s} {:10s} {:>14s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+        'mode', 'lock', 'increments/s', 'acquires', 'p50 us', 'p99 us', 'max us'))
+    for mode in MODES:
+        for lock_type in lock_types:
+            throughput, acquire_ns = run_contention(mode, lock_type, nbr_processes, max_count, batch)
+            print("{:10s} {:10s} {:14,.0f} {:10d} {:10.1f} {:10.1f} {:10.1f}".format(
+                mode, lock_type, throughput, len(acquire_ns), percentile(acquire_ns, 0.5) / 1e3,
+                percentile(acquire_ns, 0.99) / 1e3, acquire_ns[-1] / 1e3))
+
+
+def run_workers(backend='file', nbr_processes=4, max_count=MAX_COUNT_PER_PROCESS):
+    total_expected_count = nbr_processes * max_count
+    print("Starting {} process(es) to count to {} with the {} backend".format(
+        nbr_processes, total_expected_count, backend))
+    if backend == 'sharded':
+        # one slot of a cache line for each process
+        shm = shared_memory.SharedMemory(create=True, size=nbr_processes * CACHE_LINE)
+        shm.buf[:] = bytes(shm.size)
+        targets = [(work_sharded, (shm.name, slot, max_count)) for slot in range(nbr_processes)]
+    elif backend == 'value':
+        value = multiprocessing.Value('q', 0)
+        targets = [(work_value, (value, max_count))] * nbr_processes
+    else:
+        # reset counter
+        f = open(FILENAME, "w")
+        f.close()
+        targets = [(work, (FILENAME, max_count))] * nbr_processes
 
     processes = []
-    for process_nbr in range(NBR_PROCESSES):
-        p = multiprocessing.Process(target=work, args=(FILENAME, MAX_COUNT_PER_PROCESS))
+    start = time.perf_counter()
+    for target, args in targets:
+        p = multiprocessing.Process(target=target, args=args)
         p.start()
         processes.append(p)
 
     for p in processes:
         p.join()
+    exec_time = time.perf_counter() - start
 
     print("Expecting to see a count of {}".format(total_expected_count))
-    print("{} contains:".format(FILENAME))
-    os.system('more ' + FILENAME)
+    if backend == 'sharded':
+        print("Shared counter contains: {}".format(sharded_count(shm, nbr_processes)))
+        shm.close()
+        shm.unlink()
+    elif backend == 'value':
+        print("Shared value contains: {}".format(value.value))
+    else:
+        print("{} contains:".format(FILENAME))
+        os.system('more ' + FILENAME)
+    print("{:,.0f} increments per second ({:.3f} s)".format(total_expected_count / exec_time, exec_time))
 
 
 if __name__ == "__main__":
-    run_workers()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Counter shared by processes')
+    parser.add_argument('backend', nargs='?', default='file', choices=('file', 'value', 'sharded'), help='Counter backend')
+    parser.add_argument('--nbr_processes', type=int, default=4, help='Number of processes')
+    parser.add_argument('--max_count', type=int, default=None, help='Increments of each process')
+    parser.add_argument('--contention', action='store_true', help='Run the lock granularity benchmark')
+    parser.add_argument('--batch', type=int, default=100, help='Increments for each lock in batch mode')
+    args = parser.parse_args()
+
+    if args.contention:
+        print_contention(args.nbr_processes, args.max_count or 100_000, args.batch)
+    else:
+        run_workers(args.backend, args.nbr_processes, args.max_count or MAX_COUNT_PER_PROCESS)
\ No newline at end of file
@@ -24,10 +24,35 @@
 #
 #  $ python pi_parallel_worker.py --processes --nbr_samples_in_total 100000 4
 #
+# The numpy algorithm sets the same seed in every worker, so all the workers draw the same samples.
+# The streams algorithm gives each worker its own independent stream of random numbers, spawned
+# from a root seed with SeedSequence.spawn(), and draws the samples in batches of fixed size so
+# that the memory used does not depend on the number of samples. The result is the same for a
+# given root seed and number of workers, whether threads or processes are used.
+#
+#  $ python pi_parallel_worker.py --processes --algorithm streams --seed 42 --bit_generator philox 4
+#
+# The chunked algorithm draws the samples in chunks, as the streams algorithm, and adds the count
+# of each chunk to totals shared by all the workers. The main process prints the progress and all
+# the workers stop as soon as the confidence interval of the estimate of pi is smaller than the
+# requested half width, or when all the samples have been drawn.
+#
+#  $ python pi_parallel_worker.py --processes --algorithm chunked --ci_half_width 1e-4 --nbr_samples_in_total 10000000000 4
+#
+# The pool has nbr_workers workers. With the default static scheduler each worker gets one block of
+# nbr_samples_in_total / nbr_workers samples, so a slow core delays the whole run. With the dynamic
+# scheduler the samples are split into many small tasks of --task_size samples, that are sent to
+# the workers with imap_unordered() as soon as they are free. The script prints how long each
+# worker has been busy and how long it has been idle waiting for the slowest one (the straggler).
+#
+#  $ python pi_parallel_worker.py --processes --algorithm streams --scheduler dynamic --task_size 1000000 4
+#
 import os
 import random
 import time
 import argparse
+import statistics
+import threading
 import numpy as np
 import multiprocessing
 
@@ -53,12 +78,128 @@ def estimate_nbr_points_in_quarter_circle_numpy(nbr_samples):
     nbr_trials_in_quarter_unit_circle = np.sum(estimate_inside_quarter_unit_circle)
     return nbr_trials_in_quarter_unit_circle
 
+BIT_GENERATORS = {'pcg64': np.random.PCG64, 'philox': np.random.Philox}
+
+def estimate_nbr_points_in_quarter_circle_streams(task):
+    """Estimate Pi with an independent random stream per worker, in batches of fixed size.
+    task is a tuple (nbr_samples, seed_sequence, bit_generator, batch_size)"""
+    nbr_samples, seed_sequence, bit_generator, batch_size = task
+    print(f"Executing estimate_nbr_points_in_quarter_circle with {nbr_samples:,} on pid {os.getpid()}")
+    # one stream for x and one for y, so the samples do not depend on the batch size. The child
+    # sequences are built from the spawn key, spawn() would give new children at each call
+    rng_x, rng_y = [np.random.Generator(BIT_GENERATORS[bit_generator](
+                        np.random.SeedSequence(seed_sequence.entropy, spawn_key=seed_sequence.spawn_key + (i,))))
+                    for i in range(2)]
+    xs = np.empty(min(batch_size, nbr_samples))
+    ys = np.empty_like(xs)
+    nbr_trials_in_quarter_unit_circle = 0
+    for start in range(0, nbr_samples, batch_size):
+        n = min(batch_size, nbr_samples - start)
+        rng_x.random(out=xs[:n])
+        rng_y.random(out=ys[:n])
+        # xs = xs * xs + ys * ys, in place
+        np.multiply(xs[:n], xs[:n], out=xs[:n])
+        np.multiply(ys[:n], ys[:n], out=ys[:n])
+        np.add(xs[:n], ys[:n], out=xs[:n])
+        nbr_trials_in_quarter_unit_circle += int(np.count_nonzero(xs[:n] <= 1))
+    return nbr_trials_in_quarter_unit_circle
+
+# state shared by the workers of the chunked algorithm, set by init_chunked()
+chunked_state = {}
+
+def init_chunked(totals, stop, ci_half_width, confidence):
+    """Pool initializer: totals is a shared array with the number of samples and of points in the
+    quarter circle of all the workers, stop is an event set when the estimate is accurate enough"""
+    chunked_state['totals'] = totals
+    chunked_state['stop'] = stop
+    chunked_state['ci_half_width'] = ci_half_width
+    chunked_state['z'] = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+
+def pi_confidence_interval(nbr_samples, nbr_in_circle, z):
+    """Estimate of pi and half width of its confidence interval. Each sample is a Bernoulli trial
+    with probability p = pi / 4. The Wilson score interval of p is used instead of the normal
+    approximation p +- z sqrt(p (1 - p) / n), whose width is 0 when all the samples of a small
+    first chunk fall inside (or outside) the quarter circle"""
+    n = nbr_samples
+    p = nbr_in_circle / n
+    half_width = z / (1 + z * z / n) * (p * (1 - p) / n + z * z / (4 * n * n)) ** 0.5
+    return 4 * p, 4 * half_width
+
+def estimate_nbr_points_in_quarter_circle_chunked(task):
+    """Estimate Pi in chunks of fixed size, with preallocated buffers, stopping early when the
+    confidence interval of all the workers is small enough. task is a tuple (nbr_samples,
+    seed_sequence, bit_generator, chunk_size). Returns the number of samples drawn and the number
+    of points in the quarter circle."""
+    nbr_samples, seed_sequence, bit_generator, chunk_size = task
+    print(f"Executing estimate_nbr_points_in_quarter_circle with up to {nbr_samples:,} on pid {os.getpid()}")
+    totals, stop = chunked_state['totals'], chunked_state['stop']
+    rng_x, rng_y = [np.random.Generator(BIT_GENERATORS[bit_generator](
+                        np.random.SeedSequence(seed_sequence.entropy, spawn_key=seed_sequence.spawn_key + (i,))))
+                    for i in range(2)]
+    xs = np.empty(min(chunk_size, nbr_samples))
+    ys = np.empty_like(xs)
+    inside = np.empty(xs.shape, dtype=bool)
+    nbr_drawn = 0
+    nbr_trials_in_quarter_unit_circle = 0
+    while nbr_drawn < nbr_samples and not stop.is_set():
+        n = min(chunk_size, nbr_samples - nbr_drawn)
+        rng_x.random(out=xs[:n])
+        rng_y.random(out=ys[:n])
+        np.multiply(xs[:n], xs[:n], out=xs[:n])
+        np.multiply(ys[:n], ys[:n], out=ys[:n])
+        np.add(xs[:n], ys[:n], out=xs[:n])
+        np.less_equal(xs[:n], 1, out=inside[:n])
+        count = int(np.count_nonzero(inside[:n]))
+        nbr_drawn += n
+        nbr_trials_in_quarter_unit_circle += count
+        with totals.get_lock():
+            totals[0] += n
+            totals[1] += count
+            all_samples, all_in_circle = totals[0], totals[1]
+        _, half_width = pi_confidence_interval(all_samples, all_in_circle, chunked_state['z'])
+        if half_width <= chunked_state['ci_half_width']:
+            stop.set()
+    return nbr_drawn, nbr_trials_in_quarter_unit_circle
+
+def timed_task(fn_and_task):
+    """Run fn(task) and return the result with the worker that ran it and the start and end times"""
+    fn, task = fn_and_task
+    start = time.time()
+    result = fn(task)
+    worker = "{}/{}".format(os.getpid(), threading.current_thread().name)
+    return result, worker, start, time.time()
+
+def print_worker_stats(timed_results, t_start, t_end):
+    """Print the busy time of each worker, its utilization and the idle time at the end of the run"""
+    wall_time = t_end - t_start
+    workers = {}
+    for result, worker, start, end in timed_results:
+        nbr_tasks, busy, last_end = workers.get(worker, (0, 0.0, t_start))
+        workers[worker] = (nbr_tasks + 1, busy + end - start, max(last_end, end))
+    print("Worker stats ({} workers used, {:.2f} s wall time):".format(len(workers), wall_time))
+    for worker, (nbr_tasks, busy, last_end) in sorted(workers.items()):
+        print("  {}: {} tasks, busy {:.2f} s ({:.0%}), idle at the end {:.2f} s".format(
+            worker, nbr_tasks, busy, busy / wall_time, t_end - last_end))
+    task_times = [end - start for _, _, start, end in timed_results]
+    median = statistics.median(task_times)
+    print("  task time median {:.3f} s, max {:.3f} s ({:.1f}x median)".format(
+        median, max(task_times), max(task_times) / median if median > 0 else float('nan')))
+    last_ends = sorted(last_end for _, _, last_end in workers.values())
+    print("  straggler: the last worker finished {:.2f} s after the first one".format(last_ends[-1] - last_ends[0]))
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Project description')
     parser.add_argument('nbr_workers', type=int, help='Number of workers e.g. 1, 2, 4, 8')
     parser.add_argument('--nbr_samples_in_total', type=int, default=1e8, help='Number of samples in total e.g. 100000000')
     parser.add_argument('--processes', action="store_true", default=False, help='True if using Processes, absent (False) for Threads')
-    parser.add_argument('--algorithm', type=str, default='python', help='Algorithm using Python or NumPy')
+    parser.add_argument('--algorithm', type=str, default='python', choices=('python', 'numpy', 'streams', 'chunked'), help='Algorithm using Python, NumPy, streams or chunked')
+    parser.add_argument('--seed', type=int, default=1, help='Root seed of the streams algorithm')
+    parser.add_argument('--bit_generator', type=str, default='pcg64', choices=tuple(BIT_GENERATORS), help='pcg64 or philox, for the streams algorithm')
+    parser.add_argument('--batch_size', type=int, default=1_000_000, help='Samples per batch, for the streams and chunked algorithms')
+    parser.add_argument('--ci_half_width', type=float, default=0.0, help='Stop when the confidence interval of pi is this small, chunked algorithm')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the interval, chunked algorithm')
+    parser.add_argument('--scheduler', type=str, default='static', choices=('static', 'dynamic'), help='static, one block per worker, or dynamic, many small tasks')
+    parser.add_argument('--task_size', type=int, default=1_000_000, help='Samples per task with the dynamic scheduler')
     print('Number of cores: ', multiprocessing.cpu_count())
 
     args = parser.parse_args()
@@ -72,7 +213,14 @@ if __name__ == "__main__":
     nbr_samples_in_total = int(args.nbr_samples_in_total)  # should be 1e8
     nbr_parallel_blocks = int(args.nbr_workers)
 
-    pool = Pool()
+    algorithm = args.algorithm
+    if algorithm == 'chunked':
+        totals = multiprocessing.Array('q', 2)  # samples and points in the quarter circle
+        stop = multiprocessing.Event()
+        pool = Pool(nbr_parallel_blocks, initializer=init_chunked,
+                    initargs=(totals, stop, args.ci_half_width, args.confidence))
+    else:
+        pool = Pool(nbr_parallel_blocks)
 
     nbr_samples_per_worker = int(nbr_samples_in_total / nbr_parallel_blocks)
     print("Making {} samples per worker".format(nbr_samples_per_worker))
@@ -80,14 +228,51 @@ if __name__ == "__main__":
     # confirm we have an integer number of jobs to distribute
     assert nbr_samples_per_worker == int(nbr_samples_per_worker)
     nbr_samples_per_worker == int(nbr_samples_per_worker)
-    algorithm = args.algorithm
     print('Algorithm: {}'.format(algorithm))
     map_inputs = [nbr_samples_per_worker] * nbr_parallel_blocks
+    if args.scheduler == 'dynamic' and algorithm != 'chunked':
+        # many small tasks, the last one takes the remainder
+        nbr_tasks, remainder = divmod(nbr_samples_per_worker * nbr_parallel_blocks, args.task_size)
+        map_inputs = [args.task_size] * nbr_tasks + ([remainder] if remainder else [])
+        print("Scheduler: dynamic, {} tasks of {} samples".format(len(map_inputs), args.task_size))
     t1 = time.time()
-    if (algorithm=='numpy'):
-        results = pool.map(estimate_nbr_points_in_quarter_circle_numpy, map_inputs)
-    else:
-        results = pool.map(estimate_nbr_points_in_quarter_circle_python, map_inputs)
+    if algorithm in ('python', 'numpy', 'streams'):
+        if algorithm == 'streams':
+            # one child seed sequence for each block of samples
+            seed_sequences = np.random.SeedSequence(args.seed).spawn(len(map_inputs))
+            fn = estimate_nbr_points_in_quarter_circle_streams
+            tasks = [(n, seed_sequence, args.bit_generator, args.batch_size)
+                     for n, seed_sequence in zip(map_inputs, seed_sequences)]
+        elif algorithm == 'numpy':
+            fn, tasks = estimate_nbr_points_in_quarter_circle_numpy, map_inputs
+        else:
+            fn, tasks = estimate_nbr_points_in_quarter_circle_python, map_inputs
+        if args.scheduler == 'dynamic':
+            timed_results = list(pool.imap_unordered(timed_task, [(fn, task) for task in tasks], chunksize=1))
+        else:
+            timed_results = pool.map(timed_task, [(fn, task) for task in tasks])
+        results = [result for result, _, _, _ in timed_results]
+        print_worker_stats(timed_results, t1, time.time())
+    elif (algorithm=='chunked'):
+        seed_sequences = np.random.SeedSequence(args.seed).spawn(nbr_parallel_blocks)
+        tasks = [(n, seed_sequence, args.bit_generator, args.batch_size)
+                 for n, seed_sequence in zip(map_inputs, seed_sequences)]
+        z = statistics.NormalDist().inv_cdf(0.5 + args.confidence / 2)
+        async_result = pool.map_async(estimate_nbr_points_in_quarter_circle_chunked, tasks)
+        # print the progress of all the workers until they are done
+        while not async_result.ready():
+            async_result.wait(1.0)
+            with totals.get_lock():
+                all_samples, all_in_circle = totals[0], totals[1]
+            if all_samples > 0:
+                pi_estimate, half_width = pi_confidence_interval(all_samples, all_in_circle, z)
+                print('Progress: {:,} samples ({:.1%}), pi {:.6f} +/- {:.6f}'.format(
+                    all_samples, all_samples / nbr_samples_in_total, pi_estimate, half_width))
+        samples_drawn, results = zip(*async_result.get())
+        map_inputs = list(samples_drawn)
+        results = list(results)
+        if stop.is_set():
+            print('Stopped early, confidence interval reached')
     pool.close()
     exec_time = time.time() - t1
     print("Dart throws in unit circle per worker:", results)
@@ -0,0 +1,165 @@
+# This script checks if one large number is prime splitting the search for a divisor among the
+# cores, as in the notebook prime_search.ipynb. The odd divisors from 3 to sqrt(n) are split into
+# one range for each worker, and each worker tests its range in batches of batch_size divisors with
+# NumPy. A flag of one byte in shared memory tells all the workers that a factor has been found:
+# it is checked between two batches, so as soon as one worker finds a factor the others stop after
+# at most one batch and the outstanding work is cancelled. Small batches stop the workers sooner
+# but the flag is checked more often, the script measures this overhead for a few batch sizes.
+# Numbers smaller than 2^64 are first tested with the deterministic Miller-Rabin test, that gives
+# the answer in microseconds, and the trial division is used only when fast_path=False.
+#
+# $ python prime_parallel.py --nbr_workers 4
+#
+import argparse
+import math
+import time
+import numpy as np
+from multiprocessing import Pool, cpu_count, shared_memory
+#--------------------------------------------------------------------------------------------------
+#                                             Functions
+#--------------------------------------------------------------------------------------------------
+# the first 12 primes are enough bases for a deterministic test of all n < 2^64
+MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+
+def is_prime_miller_rabin(n):
+    '''
+    Deterministic Miller-Rabin test, exact for n < 2^64
+    '''
+    if n < 2:
+        return False
+    for p in MILLER_RABIN_BASES:
+        if n % p == 0:
+            return n == p
+    # n - 1 = d * 2^s with d odd
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in MILLER_RABIN_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for r in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+# shared flag of each worker, set by init_worker()
+worker_state = {}
+
+def init_worker(shm_name):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    worker_state['shm'] = shm
+    worker_state['found'] = shm.buf
+
+def search_divisors(task):
+    '''
+    Look for a divisor of n among the odd numbers in [start, stop), batch by batch. Returns the
+    divisor, 0 if there is none or if another worker has found one, and the number of batches.
+    '''
+    n, start, stop, batch_size = task
+    found = worker_state['found']
+    nbr_batches = 0
+    for batch_start in range(start, stop, 2 * batch_size):
+        if found[0]:
+            break
+        nbr_batches += 1
+        batch_stop = min(batch_start + 2 * batch_size, stop)
+        if n < 2**64:
+            divisors = np.arange(batch_start, batch_stop, 2, dtype=np.uint64)
+            hits = np.flatnonzero(np.uint64(n) % divisors == 0)
+            divisor = int(divisors[hits[0]]) if hits.size else 0
+        else:
+            divisor = next((i for i in range(batch_start, batch_stop, 2) if n % i == 0), 0)
+        if divisor:
+            found[0] = 1  # tell the other workers to stop
+            return divisor, nbr_batches
+    return 0, nbr_batches
+
+def divisor_ranges(n, nbr_workers):
+    '''
+    Split the odd divisors 3, 5, ..., isqrt(n) into nbr_workers ranges [start, stop), start odd
+    '''
+    limit = math.isqrt(n) + 1
+    bounds = np.linspace(3, limit, nbr_workers + 1).astype(np.int64)
+    return [(int(a) | 1, int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if (int(a) | 1) < b]
+
+def check_prime_parallel(n, workers=None, batch_size=100_000, fast_path=True, pool=None, stats=None):
+    '''
+    True if n is prime. The divisors are split among workers processes. pool is an optional
+    (pool, shm) pair created by make_pool(workers), to reuse the same processes for many calls.
+    If stats is a dict it gets the number of batches tested by each worker.
+    '''
+    if n < 2:
+        return False
+    if n % 2 == 0:
+        return n == 2
+    if fast_path and n < 2**64:
+        return is_prime_miller_rabin(n)
+    workers = workers or cpu_count()
+    ranges = divisor_ranges(n, workers)
+    if not ranges:
+        return True
+    own_pool = pool is None
+    pool, shm = make_pool(workers) if own_pool else pool
+    try:
+        shm.buf[0] = 0
+        tasks = [(n, start, stop, batch_size) for start, stop in ranges]
+        results = list(pool.imap_unordered(search_divisors, tasks))
+    finally:
+        if own_pool:
+            close_pool(pool, shm)
+    if stats is not None:
+        stats['batches'] = [nbr_batches for _, nbr_batches in results]
+    return not any(divisor for divisor, _ in results)
+
+def make_pool(nbr_workers):
+    shm = shared_memory.SharedMemory(create=True, size=1)
+    shm.buf[0] = 0
+    pool = Pool(nbr_workers, initializer=init_worker, initargs=(shm.name,))
+    return pool, shm
+
+def close_pool(pool, shm):
+    pool.close()
+    pool.join()
+    shm.close()
+    shm.unlink()
+
+#--------------------------------------------------------------------------------------------------
+#                                             Application
+#--------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Parallel primality test with early termination')
+    parser.add_argument('--nbr_workers', type=int, default=cpu_count(), help='Number of processes')
+    args = parser.parse_args()
+
+    prime = 1000000000000037  # a prime, all the divisors must be tested
+    composite = 100000007 * 10000000019  # the factor is inside the first range
+    for n in (prime, composite):
+        t1 = time.time()
+        result = check_prime_parallel(n)
+        print('Miller-Rabin check_prime_parallel({}) = {}, took {:.6f} s'.format(n, result, time.time() - t1))
+
+    pool = make_pool(args.nbr_workers)
+    try:
+        print('Trial division on {} workers, flag checked between batches'.format(args.nbr_workers))
+        print('{:>12s} {:>12s} {:>14s} {:>12s}   {}'.format('batch size', 'prime s', 'composite s', 'batches', 'composite batches per worker'))
+        for batch_size in (1_000, 10_000, 100_000, 1_000_000, 10_000_000):
+            times = []
+            for n in (prime, composite):
+                stats = {}
+                t1 = time.time()
+                result = check_prime_parallel(n, args.nbr_workers, batch_size, fast_path=False, pool=pool, stats=stats)
+                times.append(time.time() - t1)
+                assert result == (n == prime)
+                if n == prime:
+                    prime_batches = sum(stats['batches'])
+            # batches tested by each worker on the composite, they stop when the factor is found
+            print('{:12,d} {:12.3f} {:14.3f} {:12,d}   {}'.format(
+                batch_size, times[0], times[1], prime_batches, stats['batches']))
+    finally:
+        close_pool(*pool)
@@ -0,0 +1,131 @@
+# This script finds the prime numbers in a range [lo, hi) with a segmented Sieve of Eratosthenes,
+# instead of testing each candidate with trial division as check_prime() in prime_search.ipynb.
+# The base primes up to sqrt(hi) are computed once. The range is then split into segments that
+# are sieved independently on a pool of processes: each segment is an array with one byte for
+# each odd number, small enough to stay in the L2 cache of a core (256 KB by default), where the
+# multiples of the base primes are crossed out with slices. The result of each segment is
+# bit-packed with np.packbits() before it is sent back to the main process, so a segment of 512K
+# numbers costs only 32 KB of messages. The primes can be counted or streamed to a text file,
+# segment by segment and in order, without keeping all of them in memory.
+#
+# $ python prime_sieve.py
+#
+# The range and the other settings can be given on the command line
+#
+# $ python prime_sieve.py --lo 100000000 --hi 101000000 --nbr_workers 4 --output primes.txt
+#
+import argparse
+import math
+import time
+import numpy as np
+from multiprocessing import Pool, cpu_count
+#--------------------------------------------------------------------------------------------------
+#                                             Functions
+#--------------------------------------------------------------------------------------------------
+def base_primes(limit):
+    '''
+    Primes p <= limit with a simple sieve
+    '''
+    sieve = np.ones(limit + 1, dtype=bool)
+    sieve[:2] = False
+    for i in range(2, math.isqrt(limit) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = False
+    return np.nonzero(sieve)[0]
+
+# odd base primes, set in each worker by init_worker()
+worker_primes = None
+
+def init_worker(primes):
+    global worker_primes
+    worker_primes = primes
+
+def sieve_segment(segment):
+    '''
+    Sieve the odd numbers in [seg_lo, seg_hi), seg_lo odd. Returns seg_lo, the number of odd
+    numbers and the bit-packed flags, 1 for the primes.
+    '''
+    seg_lo, seg_hi = segment
+    size = (seg_hi - seg_lo + 1) // 2  # odd numbers seg_lo, seg_lo + 2, ...
+    is_prime = np.ones(size, dtype=bool)
+    for p in worker_primes:
+        p = int(p)
+        if p * p >= seg_hi:
+            break
+        # first odd multiple of p in the segment, not smaller than p * p
+        start = max(p * p, (seg_lo + p - 1) // p * p)
+        if start % 2 == 0:
+            start += p
+        is_prime[(start - seg_lo) // 2::p] = False
+    if seg_lo == 1:
+        is_prime[0] = False  # 1 is not a prime
+    return seg_lo, size, np.packbits(is_prime)
+
+def unpack_primes(seg_lo, size, packed):
+    is_prime = np.unpackbits(packed, count=size).view(bool)
+    return seg_lo + 2 * np.nonzero(is_prime)[0].astype(np.int64)
+
+def make_segments(lo, hi, segment_bytes):
+    '''
+    Split the odd numbers in [lo, hi) into segments of segment_bytes odd numbers
+    '''
+    first = lo | 1  # first odd number
+    span = 2 * segment_bytes
+    return [(seg_lo, min(seg_lo + span, hi)) for seg_lo in range(first, hi, span)]
+
+def sieve_range(lo, hi, nbr_workers=None, segment_bytes=256 * 1024):
+    '''
+    Yields seg_lo, size and the bit-packed flags of each segment of [lo, hi), in order
+    '''
+    primes = base_primes(math.isqrt(max(hi - 1, 1)))
+    odd_primes = primes[primes > 2]
+    segments = make_segments(lo, hi, segment_bytes)
+    with Pool(nbr_workers or cpu_count(), initializer=init_worker, initargs=(odd_primes,)) as pool:
+        for result in pool.imap(sieve_segment, segments):
+            yield result
+
+def count_primes(lo, hi, nbr_workers=None, segment_bytes=256 * 1024):
+    '''
+    Number of primes in [lo, hi)
+    '''
+    count = 1 if lo <= 2 < hi else 0
+    for seg_lo, size, packed in sieve_range(lo, hi, nbr_workers, segment_bytes):
+        count += int(np.unpackbits(packed, count=size).sum())
+    return count
+
+def primes_to_file(lo, hi, filename, nbr_workers=None, segment_bytes=256 * 1024):
+    '''
+    Write the primes in [lo, hi) to a text file, one for each line. Returns the number of primes.
+    '''
+    count = 0
+    with open(filename, 'w') as f:
+        if lo <= 2 < hi:
+            f.write('2\n')
+            count += 1
+        for seg_lo, size, packed in sieve_range(lo, hi, nbr_workers, segment_bytes):
+            primes = unpack_primes(seg_lo, size, packed)
+            np.savetxt(f, primes, fmt='%d')
+            count += len(primes)
+    return count
+
+#--------------------------------------------------------------------------------------------------
+#                                             Application
+#--------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Segmented Sieve of Eratosthenes')
+    parser.add_argument('--lo', type=int, default=100000000, help='First number of the range')
+    parser.add_argument('--hi', type=int, default=101000000, help='End of the range, excluded')
+    parser.add_argument('--nbr_workers', type=int, default=cpu_count(), help='Number of processes')
+    parser.add_argument('--segment_bytes', type=int, default=256 * 1024, help='Size of a segment, bytes')
+    parser.add_argument('--output', type=str, default=None, help='Text file for the primes')
+    args = parser.parse_args()
+
+    t1 = time.time()
+    if args.output:
+        nbr_primes = primes_to_file(args.lo, args.hi, args.output, args.nbr_workers, args.segment_bytes)
+    else:
+        nbr_primes = count_primes(args.lo, args.hi, args.nbr_workers, args.segment_bytes)
+    exec_time = time.time() - t1
+    print('{} primes in [{}, {})'.format(nbr_primes, args.lo, args.hi))
+    print('Took: {:.2f}'.format(exec_time))
@@ -0,0 +1,132 @@
+# This script checks if numbers are prime by trial division over a precomputed table of small
+# primes, instead of dividing by every odd number as check_prime() in prime_search.ipynb. The table
+# contains the primes up to sqrt(2^64) = 2^32, enough to test any 64-bit number. It is computed
+# once with the segmented sieve of prime_sieve.py and saved in a binary file of uint32 values
+# (about 800 MB), with the limit of the sieve in a small JSON file next to it. The table is
+# memory-mapped read-only: all the processes that load it share the same
+# pages of the operating system cache, so a pool of workers does not need a copy for each one.
+# The trial division tests the primes of the table up to sqrt(n) in chunks, with one vectorized
+# NumPy modulo for each chunk. The results of the last calls are kept in a bounded LRU cache, so
+# a workload that asks for the same numbers many times computes each of them only once.
+#
+# $ python prime_table.py --table small_primes.u32
+#
+# The table is built the first time, a smaller table can be used for smaller numbers
+#
+# $ python prime_table.py --table small_primes_1e8.u32 --limit 100000000
+#
+import argparse
+import json
+import math
+import os
+import random
+import time
+import numpy as np
+from functools import lru_cache
+from prime_sieve import sieve_range, unpack_primes
+#--------------------------------------------------------------------------------------------------
+#                                             Functions
+#--------------------------------------------------------------------------------------------------
+def build_table(filename, limit=2**32, nbr_workers=None):
+    '''
+    Write the primes p <= limit in a binary file of uint32, segment by segment, and the limit in
+    the file filename.json
+    '''
+    assert limit <= 2**32, 'the primes must fit in uint32'
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        np.array([2], dtype=np.uint32).tofile(f)
+        for seg_lo, size, packed in sieve_range(3, limit + 1, nbr_workers):
+            unpack_primes(seg_lo, size, packed).astype(np.uint32).tofile(f)
+    with open(filename + '.json.tmp', 'w') as f:
+        json.dump({'limit': limit}, f)
+    os.replace(filename + '.json.tmp', filename + '.json')
+    os.replace(tmp_filename, filename)  # a partial table is never used
+
+def load_table(filename):
+    '''
+    Memory-map the table read-only, the pages are shared by all the processes. Returns the table
+    and the limit of the sieve.
+    '''
+    table = np.memmap(filename, dtype=np.uint32, mode='r')
+    with open(filename + '.json') as f:
+        limit = json.load(f)['limit']
+    return table, limit
+
+def check_prime_table(n, table, limit, chunk_size=65536):
+    '''
+    True if n is prime, trial division by the primes of the table up to sqrt(n). The table has all
+    the primes up to limit.
+    '''
+    if n < 2:
+        return False
+    root = math.isqrt(n)
+    if root > limit:
+        raise ValueError('the table has the primes up to {}, {} needs the primes up to {}'.format(limit, n, root))
+    nbr_primes = int(np.searchsorted(table, root, side='right'))
+    n64 = np.uint64(n)
+    for start in range(0, nbr_primes, chunk_size):
+        chunk = table[start:min(start + chunk_size, nbr_primes)].astype(np.uint64)
+        if (n64 % chunk == 0).any():
+            return False
+    return True
+
+# table used by check_prime() and its limit, loaded by set_table()
+prime_table = None
+prime_table_limit = 0
+
+def set_table(table, limit):
+    global prime_table, prime_table_limit
+    prime_table = table
+    prime_table_limit = limit
+    check_prime.cache_clear()
+
+@lru_cache(maxsize=100_000)
+def check_prime(n):
+    '''
+    check_prime_table() with the table set by set_table() and a bounded cache of the results
+    '''
+    return check_prime_table(n, prime_table, prime_table_limit)
+
+def check_prime_odd_divisors(n):
+    # check_prime() of the notebook prime_search.ipynb
+    if n % 2 == 0:
+        return False
+    for i in range(3, int(math.sqrt(n)) + 1, 2):
+        if n % i == 0:
+            return False
+    return True
+
+#--------------------------------------------------------------------------------------------------
+#                                             Application
+#--------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Trial division with a table of small primes')
+    parser.add_argument('--table', type=str, default='small_primes.u32', help='Binary file of the table')
+    parser.add_argument('--limit', type=int, default=2**32, help='Largest number of the table')
+    parser.add_argument('--nbr_queries', type=int, default=20000, help='Number of queries')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.table):
+        t1 = time.time()
+        build_table(args.table, args.limit)
+        print('Built the table of primes up to {} in {:.2f} s'.format(args.limit, time.time() - t1))
+    set_table(*load_table(args.table))
+    print('Table: {:,} primes, {:.1f} MB'.format(len(prime_table), prime_table.nbytes / 2**20))
+
+    # repeated queries, 1000 distinct candidates asked many times
+    max_n = min(prime_table_limit ** 2, 10**14)
+    random.seed(0)
+    candidates = [random.randrange(max_n // 10, max_n) | 1 for i in range(1000)]
+    queries = [random.choice(candidates) for i in range(args.nbr_queries)]
+
+    t1 = time.time()
+    expected = [check_prime_odd_divisors(n) for n in queries[:200]]
+    odd_divisors_time = (time.time() - t1) / 200
+    t1 = time.time()
+    results = [check_prime(n) for n in queries]
+    table_time = (time.time() - t1) / len(queries)
+    assert results[:200] == expected
+    print('odd divisors: {:.1f} us per query'.format(odd_divisors_time * 1e6))
+    print('prime table with cache: {:.1f} us per query, {}'.format(table_time * 1e6, check_prime.cache_info()))